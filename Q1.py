@@ -1,72 +1,2339 @@
+import argparse
 import asyncio
+import bisect
+import hashlib
+import csv
+import errno
+import json
 import asyncssh
+import concurrent.futures
+import contextlib
 import sqlite3
 import ipaddress
 import subprocess
 import logging
-from aiohttp import ClientSession, TCPConnector
+import tempfile
+import math
+import os
+import random
+import re
+import socket
+import struct
+import time
+from aiohttp import web
+
+from icmp_echo import ICMPEchoEngine, RTTEstimator
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
+# asyncssh logs every connection at INFO, several lines for each host of a sweep
+logging.getLogger('asyncssh').setLevel(logging.WARNING)
+
+DB_PATH = 'ip_addresses.db'
+IP_ADDRESSES_TABLE = '''
+    CREATE TABLE IF NOT EXISTS ip_addresses (
+        ip INTEGER PRIMARY KEY,
+        is_active INTEGER,
+        is_ssh_connected INTEGER,
+        is_ssh_port_open INTEGER,
+        last_seen REAL,
+        ssh_banner TEXT,
+        ssh_software TEXT,
+        ssh_version TEXT
+    )
+'''
+SSH_HOST_KEYS_TABLE = '''
+    CREATE TABLE IF NOT EXISTS ssh_host_keys (
+        ip INTEGER,
+        key_type TEXT,
+        fingerprint TEXT,
+        banner TEXT,
+        first_seen REAL,
+        last_seen REAL,
+        PRIMARY KEY (ip, key_type)
+    ) WITHOUT ROWID
+'''
+SSH_DETAIL_COLUMNS = {'ssh_banner': 'TEXT', 'ssh_software': 'TEXT', 'ssh_version': 'TEXT'}
+RESULT_COLUMNS = ('ip', 'is_active', 'is_ssh_connected', 'is_ssh_port_open', 'last_seen', 'ssh_software',
+                  'ssh_version')
+CURRENT_IP_SQL = ('INSERT OR REPLACE INTO ip_addresses (ip, is_active, is_ssh_connected, is_ssh_port_open, last_seen) '
+                  'VALUES (?, ?, ?, ?, ?)')
+SAVE_IP6_SQL = '''
+    INSERT INTO ip6_addresses (ip, is_active, is_ssh_connected, is_ssh_port_open, last_seen, ssh_banner, ssh_software,
+                               ssh_version) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (ip) DO UPDATE SET
+        is_active = excluded.is_active,
+        is_ssh_connected = CASE WHEN excluded.is_ssh_port_open = 1
+            THEN COALESCE(excluded.is_ssh_connected, is_ssh_connected)
+            ELSE excluded.is_ssh_connected END,
+        is_ssh_port_open = excluded.is_ssh_port_open,
+        last_seen = excluded.last_seen,
+        ssh_banner = CASE WHEN excluded.is_ssh_port_open = 1
+            THEN COALESCE(excluded.ssh_banner, ssh_banner) ELSE excluded.ssh_banner END,
+        ssh_software = CASE WHEN excluded.is_ssh_port_open = 1
+            THEN COALESCE(excluded.ssh_software, ssh_software) ELSE excluded.ssh_software END,
+        ssh_version = CASE WHEN excluded.is_ssh_port_open = 1
+            THEN COALESCE(excluded.ssh_version, ssh_version) ELSE excluded.ssh_version END
+'''
+HOST_KEY_SQL = '''
+    INSERT INTO ssh_host_keys (ip, key_type, fingerprint, banner, first_seen, last_seen) VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT (ip, key_type) DO UPDATE SET
+        first_seen = CASE WHEN fingerprint IS excluded.fingerprint THEN first_seen ELSE excluded.first_seen END,
+        fingerprint = excluded.fingerprint,
+        banner = COALESCE(excluded.banner, banner),
+        last_seen = excluded.last_seen
+'''
+HOST_KEY_CHANGE_SQL = ('INSERT INTO ssh_host_key_changes (ip, changed_at, old_key_type, old_fingerprint, new_key_type, '
+                       'new_fingerprint) VALUES (?, ?, ?, ?, ?, ?)')
+SAVE_IP_SQL = ('INSERT INTO ip_observations (ip, is_active, is_ssh_connected, is_ssh_port_open, observed_at, '
+               'ssh_banner, ssh_software, ssh_version) VALUES (?, ?, ?, ?, ?, ?, ?, ?)')
+
+
+def create_db(path=DB_PATH):
+    """
+    Creates the SQLite database and the necessary tables to store IP addresses
+    and their statuses (active, SSH port open, SSH connected), along with the
+    scan-run metadata and per-chunk progress used to resume interrupted scans.
+
+    Results are appended to the ip_observations log. A trigger keeps ip_addresses
+    as the current state of every host, and compact_history() folds the log into
+    ip_history intervals of unchanged state.
+
+    Addresses are keyed by their 32-bit integer value, which makes the key the
+    table's rowid and keeps rows in numeric order for range queries. Tables
+    created by older versions are migrated in place.
+
+    Args:
+        path (str): Path of the SQLite database file.
+    """
+    conn = sqlite3.connect(path)
+    c = conn.cursor()
+    columns = {row[1]: row[2] for row in c.execute('PRAGMA table_info(ip_addresses)')}
+    if columns.get('ip') == 'TEXT':
+        add_missing_columns(c, 'ip_addresses', {'is_ssh_port_open': 'INTEGER', 'last_seen': 'REAL'})
+        migrate_text_keys(c)
+    c.execute(IP_ADDRESSES_TABLE)
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS scan_runs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            target TEXT,
+            chunk_size INTEGER,
+            started_at REAL,
+            finished_at REAL
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS scan_progress (
+            run_id INTEGER,
+            chunk INTEGER,
+            completed_at REAL,
+            PRIMARY KEY (run_id, chunk)
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS ip_observations (
+            ip INTEGER,
+            is_active INTEGER,
+            is_ssh_connected INTEGER,
+            is_ssh_port_open INTEGER,
+            observed_at REAL,
+            ssh_banner TEXT,
+            ssh_software TEXT,
+            ssh_version TEXT
+        )
+    ''')
+    c.execute('CREATE INDEX IF NOT EXISTS ip_observations_ip ON ip_observations (ip, observed_at)')
+    add_missing_columns(c, 'ip_addresses', SSH_DETAIL_COLUMNS)
+    add_missing_columns(c, 'ip_observations', SSH_DETAIL_COLUMNS)
+    # IPv6 addresses do not fit a 64-bit rowid, they are keyed by their 16 packed bytes
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS ip6_addresses (
+            ip BLOB PRIMARY KEY,
+            is_active INTEGER,
+            is_ssh_connected INTEGER,
+            is_ssh_port_open INTEGER,
+            last_seen REAL,
+            ssh_banner TEXT,
+            ssh_software TEXT,
+            ssh_version TEXT
+        ) WITHOUT ROWID
+    ''')
+    if [row[1] for row in c.execute('PRAGMA table_info(ssh_host_keys)') if row[5]] == ['ip']:
+        migrate_host_keys(c)
+    c.execute(SSH_HOST_KEYS_TABLE)
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS ssh_host_key_changes (
+            ip INTEGER,
+            changed_at REAL,
+            old_key_type TEXT,
+            old_fingerprint TEXT,
+            new_key_type TEXT,
+            new_fingerprint TEXT
+        )
+    ''')
+    c.execute('CREATE INDEX IF NOT EXISTS ssh_host_key_changes_time ON ssh_host_key_changes (changed_at)')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS ip_history (
+            ip INTEGER,
+            first_seen REAL,
+            last_seen REAL,
+            is_active INTEGER,
+            is_ssh_connected INTEGER,
+            is_ssh_port_open INTEGER,
+            PRIMARY KEY (ip, first_seen)
+        ) WITHOUT ROWID
+    ''')
+    # Recreated every time so it follows the current column set
+    c.execute('DROP TRIGGER IF EXISTS ip_observations_current')
+    c.execute('''
+        CREATE TRIGGER ip_observations_current AFTER INSERT ON ip_observations
+        BEGIN
+            INSERT INTO ip_addresses (ip, is_active, is_ssh_connected, is_ssh_port_open, last_seen,
+                                      ssh_banner, ssh_software, ssh_version)
+            VALUES (NEW.ip, NEW.is_active, NEW.is_ssh_connected, NEW.is_ssh_port_open, NEW.observed_at,
+                    NEW.ssh_banner, NEW.ssh_software, NEW.ssh_version)
+            ON CONFLICT (ip) DO UPDATE SET
+                is_active = excluded.is_active,
+                -- A skipped login or banner read keeps the last result while the port stays open
+                is_ssh_connected = CASE WHEN excluded.is_ssh_port_open = 1
+                    THEN COALESCE(excluded.is_ssh_connected, ip_addresses.is_ssh_connected)
+                    ELSE excluded.is_ssh_connected END,
+                is_ssh_port_open = excluded.is_ssh_port_open,
+                last_seen = excluded.last_seen,
+                ssh_banner = CASE WHEN excluded.is_ssh_port_open = 1
+                    THEN COALESCE(excluded.ssh_banner, ip_addresses.ssh_banner) ELSE excluded.ssh_banner END,
+                ssh_software = CASE WHEN excluded.is_ssh_port_open = 1
+                    THEN COALESCE(excluded.ssh_software, ip_addresses.ssh_software) ELSE excluded.ssh_software END,
+                ssh_version = CASE WHEN excluded.is_ssh_port_open = 1
+                    THEN COALESCE(excluded.ssh_version, ip_addresses.ssh_version) ELSE excluded.ssh_version END
+            WHERE excluded.last_seen >= ip_addresses.last_seen OR ip_addresses.last_seen IS NULL;
+        END
+    ''')
+    conn.commit()
+    conn.close()
+
+
+def add_missing_columns(cursor, table, columns):
+    """
+    Adds the given columns to an existing table if they are not there yet.
+
+    Args:
+        cursor (sqlite3.Cursor): Cursor of the open database.
+        table (str): Name of the table to alter.
+        columns (dict): Column names mapped to their SQL types.
+    """
+    existing = {row[1] for row in cursor.execute(f'PRAGMA table_info({table})')}
+    for name, column_type in columns.items():
+        if name not in existing:
+            cursor.execute(f'ALTER TABLE {table} ADD COLUMN {name} {column_type}')
+
+
+def migrate_text_keys(cursor):
+    """
+    Converts an ip_addresses table keyed by dotted-quad text into the integer-keyed layout.
+
+    Args:
+        cursor (sqlite3.Cursor): Cursor of the open database.
+    """
+    logger.info("Migrating ip_addresses to integer keys...")
+    cursor.execute('ALTER TABLE ip_addresses RENAME TO ip_addresses_text')
+    cursor.execute(IP_ADDRESSES_TABLE)
+    rows = cursor.connection.execute(
+        'SELECT ip, is_active, is_ssh_connected, is_ssh_port_open, last_seen FROM ip_addresses_text')
+    cursor.executemany(CURRENT_IP_SQL, ((ip_to_int(ip), *row) for ip, *row in rows))
+    cursor.execute('DROP TABLE ip_addresses_text')
+
+
+def migrate_host_keys(cursor):
+    """
+    Converts an ssh_host_keys table keyed by IP alone into the layout keyed by IP and key type.
+
+    Args:
+        cursor (sqlite3.Cursor): Cursor of the open database.
+    """
+    logger.info("Migrating ssh_host_keys to per-type keys...")
+    cursor.execute('ALTER TABLE ssh_host_keys RENAME TO ssh_host_keys_by_ip')
+    cursor.execute(SSH_HOST_KEYS_TABLE)
+    cursor.execute('INSERT INTO ssh_host_keys (ip, key_type, fingerprint, banner, first_seen, last_seen) '
+                   'SELECT ip, key_type, fingerprint, banner, first_seen, last_seen FROM ssh_host_keys_by_ip')
+    cursor.execute('DROP TABLE ssh_host_keys_by_ip')
+
+
+def ip_to_int(ip):
+    """
+    Converts a dotted-quad IPv4 address into its integer value.
+
+    Args:
+        ip (str): The IP address.
+
+    Returns:
+        int: The 32-bit address.
+    """
+    return int(ipaddress.IPv4Address(ip))
+
+
+def int_to_ip(value):
+    """
+    Converts a 32-bit integer into a dotted-quad IPv4 address.
+
+    Args:
+        value (int): The 32-bit address.
+
+    Returns:
+        str: The IP address.
+    """
+    return str(ipaddress.IPv4Address(value))
+
+
+def ip6_to_bytes(ip):
+    """
+    Converts an IPv6 address into its 16-byte big-endian form, which sorts like the address.
+
+    Args:
+        ip (str): The IP address.
+
+    Returns:
+        bytes: The packed address.
+    """
+    return ipaddress.IPv6Address(ip).packed
+
+
+def bytes_to_ip6(value):
+    """
+    Converts a 16-byte packed IPv6 address into its compressed text form.
+
+    Args:
+        value (bytes): The packed address.
+
+    Returns:
+        str: The IP address.
+    """
+    return str(ipaddress.IPv6Address(value))
+
+
+def query_range(cidr=None, is_active=None, is_ssh_connected=None, path=DB_PATH):
+    """
+    Streams the stored status of every address in a CIDR range, in numeric order.
+    The range is resolved as a rowid interval, so no full table scan is needed.
+    Rows are read from the cursor as they are consumed, never loaded all at once.
+
+    Args:
+        cidr (str): The range to look up, e.g. "172.29.12.0/22", or None for every address.
+        is_active (int): If given, only return rows with this is_active value.
+        is_ssh_connected (int): If given, only return rows with this is_ssh_connected value.
+        path (str): Path of the SQLite database file.
+
+    Yields:
+        tuple: Rows with the values of RESULT_COLUMNS.
+    """
+    network = ipaddress.IPv4Network(cidr or '0.0.0.0/0')
+    sql = f"SELECT {', '.join(RESULT_COLUMNS)} FROM ip_addresses WHERE ip BETWEEN ? AND ?"
+    params = [int(network.network_address), int(network.broadcast_address)]
+    if is_active is not None:
+        sql += ' AND is_active = ?'
+        params.append(is_active)
+    if is_ssh_connected is not None:
+        sql += ' AND is_ssh_connected = ?'
+        params.append(is_ssh_connected)
+    conn = sqlite3.connect(path)
+    try:
+        for ip, *row in conn.execute(sql + ' ORDER BY ip', params):
+            yield (int_to_ip(ip), *row)
+    finally:
+        conn.close()
+
+
+def query_ipv6(prefix=None, is_active=None, is_ssh_connected=None, path=DB_PATH):
+    """
+    Streams the stored status of every IPv6 address in a prefix, in numeric order.
+    Packed addresses compare like the numbers they encode, so the prefix is
+    resolved as a key interval just like in query_range().
+
+    Args:
+        prefix (str): The prefix to look up, e.g. "2001:db8::/48", or None for every address.
+        is_active (int): If given, only return rows with this is_active value.
+        is_ssh_connected (int): If given, only return rows with this is_ssh_connected value.
+        path (str): Path of the SQLite database file.
+
+    Yields:
+        tuple: Rows with the values of RESULT_COLUMNS.
+    """
+    network = ipaddress.IPv6Network(prefix or '::/0')
+    sql = f"SELECT {', '.join(RESULT_COLUMNS)} FROM ip6_addresses WHERE ip BETWEEN ? AND ?"
+    params = [network.network_address.packed, network.broadcast_address.packed]
+    if is_active is not None:
+        sql += ' AND is_active = ?'
+        params.append(is_active)
+    if is_ssh_connected is not None:
+        sql += ' AND is_ssh_connected = ?'
+        params.append(is_ssh_connected)
+    conn = sqlite3.connect(path)
+    try:
+        for ip, *row in conn.execute(sql + ' ORDER BY ip', params):
+            yield (bytes_to_ip6(ip), *row)
+    finally:
+        conn.close()
+
+
+def subnet_counts(cidr, prefixlen=24, path=DB_PATH):
+    """
+    Counts the stored, live, SSH-open and SSH-connected hosts per subnet of a range.
+
+    Args:
+        cidr (str): The range to summarize, e.g. "172.29.0.0/16".
+        prefixlen (int): Prefix length of the subnets to group by.
+        path (str): Path of the SQLite database file.
+
+    Returns:
+        list: (subnet, hosts, active, ssh_port_open, ssh_connected) tuples, one per
+        subnet with stored hosts.
+    """
+    network = ipaddress.IPv4Network(cidr)
+    shift = 32 - prefixlen
+    conn = sqlite3.connect(path)
+    try:
+        rows = conn.execute(
+            'SELECT ip >> ?, COUNT(*), SUM(is_active), SUM(is_ssh_port_open), SUM(is_ssh_connected) '
+            'FROM ip_addresses WHERE ip BETWEEN ? AND ? GROUP BY ip >> ? ORDER BY 1',
+            (shift, int(network.network_address), int(network.broadcast_address), shift)).fetchall()
+    finally:
+        conn.close()
+    return [(f"{int_to_ip(prefix << shift)}/{prefixlen}", hosts, active or 0, port_open or 0, connected or 0)
+            for prefix, hosts, active, port_open, connected in rows]
+
+
+def diff_scans(old_path, new_path, cidr=None):
+    """
+    Compares the results of two scans stored in separate databases and reports
+    the hosts whose active or SSH status differs, including hosts only one scan saw.
+
+    Args:
+        old_path (str): Database of the earlier scan.
+        new_path (str): Database of the later scan.
+        cidr (str): If given, only compare addresses in this range.
+
+    Returns:
+        list: (ip, old_is_active, old_is_ssh_connected, new_is_active, new_is_ssh_connected)
+        tuples, with None for the side that has no row.
+    """
+    low, high = 0, 2 ** 32 - 1
+    if cidr is not None:
+        network = ipaddress.IPv4Network(cidr)
+        low, high = int(network.network_address), int(network.broadcast_address)
+    conn = sqlite3.connect(new_path)
+    try:
+        conn.execute('ATTACH DATABASE ? AS old', (old_path,))
+        rows = conn.execute('''
+            SELECT n.ip, o.is_active, o.is_ssh_connected, n.is_active, n.is_ssh_connected
+            FROM main.ip_addresses n LEFT JOIN old.ip_addresses o ON o.ip = n.ip
+            WHERE n.ip BETWEEN ? AND ?
+              AND (o.ip IS NULL OR o.is_active IS NOT n.is_active OR o.is_ssh_connected IS NOT n.is_ssh_connected)
+            UNION ALL
+            SELECT o.ip, o.is_active, o.is_ssh_connected, NULL, NULL
+            FROM old.ip_addresses o
+            WHERE o.ip BETWEEN ? AND ? AND NOT EXISTS (SELECT 1 FROM main.ip_addresses n WHERE n.ip = o.ip)
+            ORDER BY 1
+        ''', (low, high, low, high)).fetchall()
+    finally:
+        conn.close()
+    return [(int_to_ip(ip), *row) for ip, *row in rows]
+
+
+def fold_observations(current, observations):
+    """
+    Folds the time-ordered observations of one host into intervals of unchanged state.
+    Like the ip_observations trigger, an observation without a login result (banner
+    and verify modes) keeps the previous result while the port stays open.
+
+    Args:
+        current (list): The host's latest interval [first_seen, last_seen, is_active,
+            is_ssh_connected, is_ssh_port_open], or None.
+        observations (iterable): (observed_at, is_active, is_ssh_connected,
+            is_ssh_port_open) tuples in time order.
+
+    Returns:
+        list: Intervals [first_seen, last_seen, is_active, is_ssh_connected,
+        is_ssh_port_open]. When the first observations repeat the state of
+        `current`, it is extended and returned first.
+    """
+    intervals = [list(current)] if current else []
+    for observed_at, is_active, is_ssh_connected, is_ssh_port_open in observations:
+        if is_ssh_connected is None and is_ssh_port_open == 1 and intervals:
+            is_ssh_connected = intervals[-1][3]
+        state = [is_active, is_ssh_connected, is_ssh_port_open]
+        if intervals and intervals[-1][2:] == state:
+            intervals[-1][1] = max(intervals[-1][1], observed_at)
+        else:
+            intervals.append([observed_at, observed_at, *state])
+    return intervals
+
+
+def compact_history(path=DB_PATH, before=None, batch_size=10000):
+    """
+    Folds the observations logged before the given time into ip_history intervals
+    and removes them from the log, so history queries read one row per state change
+    instead of one row per probe. Each batch is one IMMEDIATE transaction, which
+    makes concurrent compactions from several processes safe.
+
+    Args:
+        path (str): Path of the SQLite database file.
+        before (float): Only compact observations older than this timestamp, now if None.
+        batch_size (int): Maximum number of observations folded per transaction.
+
+    Returns:
+        int: The number of observations folded.
+    """
+    before = time.time() if before is None else before
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+    folded = 0
+    try:
+        while True:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                rows = conn.execute(
+                    'SELECT rowid, ip, observed_at, is_active, is_ssh_connected, is_ssh_port_open '
+                    'FROM ip_observations WHERE observed_at < ? ORDER BY ip, observed_at LIMIT ?',
+                    (before, batch_size)).fetchall()
+                start = 0
+                for end in range(1, len(rows) + 1):
+                    if end < len(rows) and rows[end][1] == rows[start][1]:
+                        continue
+                    ip = rows[start][1]
+                    current = conn.execute(
+                        'SELECT first_seen, last_seen, is_active, is_ssh_connected, is_ssh_port_open FROM ip_history '
+                        'WHERE ip = ? ORDER BY first_seen DESC LIMIT 1', (ip,)).fetchone()
+                    intervals = fold_observations(current, (row[2:] for row in rows[start:end]))
+                    conn.executemany('INSERT OR REPLACE INTO ip_history VALUES (?, ?, ?, ?, ?, ?)',
+                                     ((ip, *interval) for interval in intervals))
+                    start = end
+                conn.executemany('DELETE FROM ip_observations WHERE rowid = ?', ((row[0],) for row in rows))
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            folded += len(rows)
+            if len(rows) < batch_size:
+                return folded
+    finally:
+        conn.close()
+
+
+async def compact_periodically(path=DB_PATH, interval=300.0):
+    """
+    Runs compact_history in a worker thread at a fixed interval until cancelled.
+
+    Args:
+        path (str): Path of the SQLite database file.
+        interval (float): Seconds between compactions.
+    """
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            folded = await asyncio.to_thread(compact_history, path)
+            logger.info(f"Compacted {folded} observations into history")
+        except sqlite3.Error as e:
+            logger.error(f"History compaction failed: {e}")
+
+
+def host_history(ip, path=DB_PATH):
+    """
+    Returns the state history of one host, including observations not compacted yet.
+
+    Args:
+        ip (str): The IP address.
+        path (str): Path of the SQLite database file.
+
+    Returns:
+        list: (first_seen, last_seen, is_active, is_ssh_connected, is_ssh_port_open)
+        tuples in time order.
+    """
+    key = ip_to_int(ip)
+    conn = sqlite3.connect(path)
+    try:
+        intervals = conn.execute(
+            'SELECT first_seen, last_seen, is_active, is_ssh_connected, is_ssh_port_open FROM ip_history '
+            'WHERE ip = ? ORDER BY first_seen', (key,)).fetchall()
+        pending = conn.execute(
+            'SELECT observed_at, is_active, is_ssh_connected, is_ssh_port_open FROM ip_observations '
+            'WHERE ip = ? ORDER BY observed_at', (key,)).fetchall()
+    finally:
+        conn.close()
+    folded = fold_observations(intervals[-1] if intervals else None, pending)
+    return [tuple(interval) for interval in intervals[:-1] + folded]
+
+
+def state_changes(cidr, since, until=None, path=DB_PATH):
+    """
+    Lists the compacted state changes of the hosts in a CIDR range within a time
+    window, e.g. which hosts came up or went down since yesterday.
+
+    Args:
+        cidr (str): The range to look up.
+        since (float): Start of the window as a UNIX timestamp.
+        until (float): End of the window, now if None.
+        path (str): Path of the SQLite database file.
+
+    Returns:
+        list: (ip, changed_at, old_is_active, new_is_active, old_is_ssh_connected,
+        new_is_ssh_connected) tuples, with None as the old state of newly seen hosts.
+    """
+    network = ipaddress.IPv4Network(cidr)
+    until = time.time() if until is None else until
+    conn = sqlite3.connect(path)
+    try:
+        rows = conn.execute('''
+            SELECT ip, first_seen, old_active, is_active, old_ssh, is_ssh_connected FROM (
+                SELECT ip, first_seen, is_active, is_ssh_connected,
+                       LAG(is_active) OVER w AS old_active, LAG(is_ssh_connected) OVER w AS old_ssh
+                FROM ip_history WHERE ip BETWEEN ? AND ?
+                WINDOW w AS (PARTITION BY ip ORDER BY first_seen)
+            )
+            WHERE first_seen >= ? AND first_seen < ?
+            ORDER BY first_seen
+        ''', (int(network.network_address), int(network.broadcast_address), since, until)).fetchall()
+    finally:
+        conn.close()
+    return [(int_to_ip(ip), *row) for ip, *row in rows]
+
+
+def host_key_changes(since=0.0, path=DB_PATH):
+    """
+    Lists the SSH host key changes detected by sweeps since the given time.
+
+    Args:
+        since (float): Start of the window as a UNIX timestamp.
+        path (str): Path of the SQLite database file.
+
+    Returns:
+        list: (ip, changed_at, old_key_type, old_fingerprint, new_key_type, new_fingerprint) tuples.
+    """
+    conn = sqlite3.connect(path)
+    try:
+        rows = conn.execute(
+            'SELECT ip, changed_at, old_key_type, old_fingerprint, new_key_type, new_fingerprint '
+            'FROM ssh_host_key_changes WHERE changed_at >= ? ORDER BY changed_at', (since,)).fetchall()
+    finally:
+        conn.close()
+    return [(int_to_ip(ip), *row) for ip, *row in rows]
+
+
+EXPORT_STATES = {
+    'active': {'is_active': 1},
+    'inactive': {'is_active': 0},
+    'ssh': {'is_ssh_connected': 1},
+}
+
+
+def export_results(output, fmt=None, cidr=None, state=None, path=DB_PATH, batch_size=10000):
+    """
+    Streams the current scan results into a CSV, JSON Lines or Parquet file. Rows
+    are pulled from the database cursor and written in batches, so memory stays
+    constant regardless of the table size. Parquet output requires pyarrow.
+
+    Args:
+        output (str): Path of the file to write.
+        fmt (str): "csv", "jsonl" or "parquet"; derived from the file extension if None.
+        cidr (str): If given, only export addresses in this range.
+        state (str): If given, only export hosts in this state, a key of EXPORT_STATES.
+        path (str): Path of the SQLite database file.
+        batch_size (int): Rows per Parquet row group.
+
+    Returns:
+        int: The number of exported rows.
+    """
+    fmt = fmt or os.path.splitext(output)[1].lstrip('.').lower()
+    rows = query_range(cidr, path=path, **EXPORT_STATES.get(state, {}))
+    count = 0
+    if fmt == 'csv':
+        with open(output, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(RESULT_COLUMNS)
+            for row in rows:
+                writer.writerow(row)
+                count += 1
+    elif fmt in ('jsonl', 'ndjson'):
+        with open(output, 'w') as f:
+            for row in rows:
+                f.write(json.dumps(dict(zip(RESULT_COLUMNS, row))) + '\n')
+                count += 1
+    elif fmt == 'parquet':
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise RuntimeError("Parquet export requires pyarrow (pip install pyarrow)")
+        schema = pa.schema([('ip', pa.string()), ('is_active', pa.int8()), ('is_ssh_connected', pa.int8()),
+                            ('is_ssh_port_open', pa.int8()), ('last_seen', pa.float64()),
+                            ('ssh_software', pa.string()), ('ssh_version', pa.string())])
+        with pq.ParquetWriter(output, schema) as writer:
+            while True:
+                batch = [row for _, row in zip(range(batch_size), rows)]
+                if not batch:
+                    break
+                writer.write_batch(pa.RecordBatch.from_pylist(
+                    [dict(zip(RESULT_COLUMNS, row)) for row in batch], schema=schema))
+                count += len(batch)
+    else:
+        raise ValueError(f"Unsupported export format: {fmt}")
+    return count
+
+
+class ResultWriter:
+    """
+    Collects scan results through a queue and writes them over a single WAL-mode
+    connection, flushing with executemany in transactions bounded by size or time.
+    Commits run in a worker thread so they never block the event loop. Statements
+    are committed in the order they were queued.
+
+    A batch that fails with an operational error, such as a locked database, is
+    retried. If it still cannot be written, the writer stops: nothing queued after
+    it is committed, and execute() and close() raise the error, so the scan fails
+    instead of recording progress for results that were never stored.
+    """
+
+    def __init__(self, path=DB_PATH, batch_size=500, flush_interval=1.0, metrics=None, retries=3,
+                 retry_delay=1.0):
+        """
+        Initializes the writer without opening the database.
+
+        Args:
+            path (str): Path of the SQLite database file.
+            batch_size (int): Maximum number of rows per transaction.
+            flush_interval (float): Maximum seconds a result waits before being committed.
+            metrics (ScanMetrics): If given, receives the result counts and write timings.
+            retries (int): Maximum attempts to write a batch that fails with an operational error.
+            retry_delay (float): Seconds between the attempts, on top of the connection's busy timeout.
+        """
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.queue = asyncio.Queue(maxsize=batch_size * 4)
+        self.metrics = metrics
+        if metrics is not None:
+            metrics.write_queue = self.queue
+        self._conn = None
+        self._task = None
+        self._error = None
+
+    async def start(self):
+        """
+        Opens the connection and starts the background flush task.
+        """
+        self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._task = asyncio.create_task(self._run())
+
+    async def submit(self, ip, is_active, is_ssh_connected, is_ssh_port_open, ssh_banner=None):
+        """
+        Queues the status of an IP address for writing.
+
+        Args:
+            ip (str): The IP address to store.
+            is_active (int): 1 if the IP is active, 0 if not.
+            is_ssh_connected (int): 1 if SSH connection was successful, 0 if not, None if not attempted.
+            is_ssh_port_open (int): 1 if TCP port 22 accepted a connection, 0 if not.
+            ssh_banner (str): The SSH identification string sent by the server, if it was read.
+        """
+        software, version = parse_ssh_banner(ssh_banner)
+        if self.metrics is not None:
+            self.metrics.result(is_active, is_ssh_port_open, is_ssh_connected)
+        if ':' in ip:
+            await self.execute(SAVE_IP6_SQL, (ip6_to_bytes(ip), is_active, is_ssh_connected, is_ssh_port_open,
+                                              time.time(), ssh_banner, software, version))
+            return
+        await self.execute(SAVE_IP_SQL, (ip_to_int(ip), is_active, is_ssh_connected, is_ssh_port_open, time.time(),
+                                         ssh_banner, software, version))
+
+    async def execute(self, sql, params):
+        """
+        Queues an arbitrary statement, committed after everything queued before it.
+
+        Args:
+            sql (str): The SQL statement.
+            params (tuple): The statement parameters.
+
+        Raises:
+            sqlite3.Error: If the writer stopped after failing to write a batch.
+        """
+        if self._error is not None:
+            raise self._error
+        await self.queue.put((sql, params))
+
+    async def close(self):
+        """
+        Flushes every queued result, then closes the connection.
+
+        Raises:
+            sqlite3.Error: If the writer stopped after failing to write a batch.
+        """
+        if self._task is None:
+            return
+        await self.queue.put(None)
+        await self._task
+        self._task = None
+        self._conn.close()
+        if self._error is not None:
+            raise self._error
+
+    async def _run(self):
+        """
+        Collects batches from the queue and commits them until the None sentinel arrives.
+        """
+        loop = asyncio.get_running_loop()
+        done = False
+        while not done:
+            row = await self.queue.get()
+            if row is None:
+                return
+            batch = [row]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    row = self.queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        row = await asyncio.wait_for(self.queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                if row is None:
+                    done = True
+                    break
+                batch.append(row)
+            try:
+                await asyncio.to_thread(self._write, batch)
+            except sqlite3.Error as e:
+                logger.error(f"Failed to write {len(batch)} statements, stopping the result writer: {e}")
+                self._error = e
+                if not done:
+                    # Discard everything queued until close(), so producers blocked on the full queue carry on
+                    while await self.queue.get() is not None:
+                        pass
+                return
+
+    def _write(self, batch):
+        """
+        Writes one batch in a single transaction, grouping consecutive runs of the
+        same statement into one executemany call.
+
+        Args:
+            batch (list): (sql, params) tuples.
+
+        Raises:
+            sqlite3.Error: If the batch could not be written, after the retries of operational errors.
+        """
+        timer = self.metrics.phase('db_write') if self.metrics is not None else contextlib.nullcontext()
+        with timer:
+            for attempt in range(1, self.retries + 1):
+                try:
+                    with self._conn:
+                        start = 0
+                        for end in range(1, len(batch) + 1):
+                            if end == len(batch) or batch[end][0] != batch[start][0]:
+                                self._conn.executemany(batch[start][0], [params for _, params in batch[start:end]])
+                                start = end
+                    break
+                except sqlite3.OperationalError as e:
+                    if attempt >= self.retries:
+                        raise
+                    logger.warning(f"Failed to write {len(batch)} statements, retrying "
+                                   f"({attempt}/{self.retries}): {e}")
+                    time.sleep(self.retry_delay)
+        if self.metrics is not None:
+            self.metrics.statements += len(batch)
+
+
+def parse_target_spec(spec, hosts_only=True):
+    """
+    Parses one target specification into inclusive integer address intervals.
+
+    Accepted forms are a CIDR network ("10.0.0.0/8"), a single address, an address
+    range ("10.0.0.10-10.0.0.50") and "@path" for a file with one specification
+    per line, where "#" starts a comment.
+
+    Args:
+        spec (str): The specification.
+        hosts_only (bool): Leave out the network and broadcast addresses of CIDR networks.
+
+    Returns:
+        list: (first, last) integer address pairs.
+    """
+    spec = spec.strip()
+    if spec.startswith('@'):
+        intervals = []
+        with open(spec[1:]) as f:
+            for line in f:
+                line = line.split('#', 1)[0].strip()
+                if line:
+                    intervals.extend(parse_target_spec(line, hosts_only))
+        return intervals
+    if '-' in spec:
+        first, last = (ip_to_int(part.strip()) for part in spec.split('-', 1))
+        if first > last:
+            raise ValueError(f"Empty address range: {spec}")
+        return [(first, last)]
+    network = ipaddress.IPv4Network(spec, strict=False)
+    first, last = int(network.network_address), int(network.broadcast_address)
+    if hosts_only and network.prefixlen < 31:
+        # Skip the network and broadcast addresses, like IPv4Network.hosts()
+        first += 1
+        last -= 1
+    return [(first, last)]
+
+
+def merge_intervals(intervals):
+    """
+    Sorts inclusive intervals and merges the overlapping and adjacent ones.
+
+    Args:
+        intervals (iterable): (first, last) pairs.
+
+    Returns:
+        list: The merged (first, last) pairs in ascending order.
+    """
+    merged = []
+    for first, last in sorted(intervals):
+        if merged and first <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], last))
+        else:
+            merged.append((first, last))
+    return merged
+
+
+def subtract_intervals(intervals, excluded):
+    """
+    Removes the excluded addresses from a set of intervals.
+
+    Args:
+        intervals (list): Merged (first, last) pairs in ascending order.
+        excluded (list): Merged (first, last) pairs in ascending order.
+
+    Returns:
+        list: The remaining (first, last) pairs in ascending order.
+    """
+    result = []
+    j = 0
+    for first, last in intervals:
+        while j < len(excluded) and excluded[j][1] < first:
+            j += 1
+        k = j
+        while first <= last and k < len(excluded) and excluded[k][0] <= last:
+            if excluded[k][0] > first:
+                result.append((first, excluded[k][0] - 1))
+            first = max(first, excluded[k][1] + 1)
+            k += 1
+        if first <= last:
+            result.append((first, last))
+    return result
+
+
+class TargetSet:
+    """
+    A set of IPv4 host addresses stored as sorted, merged intervals. It is
+    addressable by index and iterated lazily, so its size is O(number of
+    intervals) no matter how many addresses it covers.
+    """
+
+    def __init__(self, intervals, name=None):
+        """
+        Initializes the set.
+
+        Args:
+            intervals (iterable): (first, last) inclusive integer address pairs, in any order.
+            name (str): Identifies the set in scan checkpoints, derived from the intervals if None.
+        """
+        self.intervals = merge_intervals(intervals)
+        self._offsets = []
+        total = 0
+        for first, last in self.intervals:
+            self._offsets.append(total)
+            total += last - first + 1
+        self.count = total
+        self._name = name
+
+    @classmethod
+    def parse(cls, specs, exclude=()):
+        """
+        Builds a set from target specifications minus exclusions (see parse_target_spec).
+
+        Args:
+            specs (str or list): The specifications of the addresses to include.
+            exclude (list): The specifications of the addresses to leave out.
+
+        Returns:
+            TargetSet: The normalized set.
+        """
+        if isinstance(specs, str):
+            specs = [specs]
+        included = merge_intervals(interval for spec in specs for interval in parse_target_spec(spec))
+        excluded = merge_intervals(interval for spec in exclude or ()
+                                   for interval in parse_target_spec(spec, hosts_only=False))
+        # A file's contents can change between runs, so only literal specs name the set
+        literal = len(specs) == 1 and not excluded and not specs[0].strip().startswith('@')
+        return cls(subtract_intervals(included, excluded), specs[0] if literal else None)
+
+    def shard(self, index, count):
+        """
+        Returns one of `count` contiguous, near-equal slices of this set.
+
+        Args:
+            index (int): Zero-based index of the shard.
+            count (int): Total number of shards.
+
+        Returns:
+            TargetSet: The shard.
+        """
+        start = index * self.count // count
+        stop = (index + 1) * self.count // count
+        intervals = []
+        for (first, last), offset in zip(self.intervals, self._offsets):
+            low = max(start, offset)
+            high = min(stop, offset + last - first + 1)
+            if low < high:
+                intervals.append((first + low - offset, first + high - offset - 1))
+        return TargetSet(intervals)
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        if not 0 <= index < self.count:
+            raise IndexError(index)
+        i = bisect.bisect_right(self._offsets, index) - 1
+        return int_to_ip(self.intervals[i][0] + index - self._offsets[i])
+
+    def __iter__(self):
+        for first, last in self.intervals:
+            for value in range(first, last + 1):
+                yield int_to_ip(value)
+
+    def __str__(self):
+        if self._name:
+            return self._name
+        name = ','.join(f"{int_to_ip(first)}-{int_to_ip(last)}" for first, last in self.intervals)
+        if len(name) > 200:
+            name = 'targets:' + hashlib.sha1(name.encode()).hexdigest()[:16]
+        return name
+
+
+class AddressPermutation:
+    """
+    Pseudo-random permutation of the indices 0..count-1, computed with a keyed
+    Feistel network over the next power-of-four domain and cycle walking back
+    into range. Any index is mapped in constant time and memory, so a scan in
+    permuted order is reproducible from its seed and can resume at any position.
+    """
+
+    ROUNDS = 4
+
+    def __init__(self, count, seed=0):
+        """
+        Initializes the permutation.
+
+        Args:
+            count (int): Size of the permuted index range.
+            seed (int): Seed deriving the round keys.
+        """
+        self.count = count
+        bits = max(2, (count - 1).bit_length())
+        self.half = (bits + 1) // 2
+        self.mask = (1 << self.half) - 1
+        rng = random.Random(seed)
+        self.keys = [rng.getrandbits(32) for _ in range(self.ROUNDS)]
+
+    def _round(self, value, key):
+        value = (value * 0x9e3779b1 + key) & 0xffffffff
+        value ^= value >> 16
+        value = (value * 0x85ebca6b) & 0xffffffff
+        value ^= value >> 13
+        return value & self.mask
+
+    def _encrypt(self, value):
+        left, right = value >> self.half, value & self.mask
+        for key in self.keys:
+            left, right = right, left ^ self._round(right, key)
+        return (left << self.half) | right
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        if not 0 <= index < self.count:
+            raise IndexError(index)
+        value = self._encrypt(index)
+        while value >= self.count:
+            value = self._encrypt(value)
+        return value
+
+
+class PermutedHosts:
+    """
+    Visits the addresses of a TargetSet in the order of an AddressPermutation, so
+    concurrent probes spread over the whole range instead of one /24 at a time.
+    """
+
+    def __init__(self, hosts, seed=0):
+        """
+        Initializes the permuted view.
+
+        Args:
+            hosts (TargetSet): The addresses to permute.
+            seed (int): Seed of the permutation.
+        """
+        self.hosts = hosts
+        self.permutation = AddressPermutation(len(hosts), seed)
+
+    def __len__(self):
+        return len(self.hosts)
+
+    def __getitem__(self, index):
+        return self.hosts[self.permutation[index]]
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+
+IPV6_TOKEN = re.compile(r'[0-9A-Fa-f:.]*:[0-9A-Fa-f:.]*')
+
+
+def hitlist_address(token):
+    """
+    Parses a candidate IPv6 address, rejecting the ones a hit-list scan cannot probe:
+    link-local addresses need an interface scope, multicast and unspecified
+    addresses are not hosts.
+
+    Args:
+        token (str): The text that may hold an address.
+
+    Returns:
+        ipaddress.IPv6Address: The address, or None if the token is not a usable address.
+    """
+    try:
+        address = ipaddress.IPv6Address(token)
+    except ValueError:
+        return None
+    if address.is_link_local or address.is_multicast or address.is_unspecified:
+        return None
+    return address
+
+
+def read_hitlist_file(path):
+    """
+    Streams the IPv6 addresses found anywhere in a text file. Besides plain
+    address lists this covers DHCPv6 server logs and lease files, e.g. dnsmasq's
+    "DHCPREPLY(eth0) 2001:db8::5 ..." lines or ISC dhcpd's "iaaddr 2001:db8::5 {".
+
+    Args:
+        path (str): Path of the file.
+
+    Yields:
+        ipaddress.IPv6Address: The addresses in file order, duplicates included.
+    """
+    with open(path) as f:
+        for line in f:
+            for token in IPV6_TOKEN.findall(line.split('#', 1)[0]):
+                address = hitlist_address(token)
+                if address is not None:
+                    yield address
+
+
+def read_ipv6_neighbors():
+    """
+    Reads the kernel IPv6 neighbor cache, i.e. the hosts neighbor discovery has
+    found on the attached links.
+
+    Returns:
+        dict: Maps each global or unique-local address to its neighbor state, e.g.
+        "REACHABLE". Empty if the cache cannot be read.
+    """
+    try:
+        result = subprocess.run(['ip', '-6', 'neigh', 'show'], stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                text=True, check=True)
+    except (OSError, subprocess.CalledProcessError) as e:
+        logger.debug(f"IPv6 neighbor cache unavailable: {e}")
+        return {}
+    neighbors = {}
+    for fields in map(str.split, result.stdout.splitlines()):
+        address = hitlist_address(fields[0]) if fields else None
+        if address is not None and fields[-1] not in ('FAILED', 'INCOMPLETE'):
+            neighbors[str(address)] = fields[-1]
+    return neighbors
+
+
+def previous_ipv6_hosts(path=DB_PATH):
+    """
+    Streams the IPv6 addresses stored by earlier scans.
+
+    Args:
+        path (str): Path of the SQLite database file.
+
+    Yields:
+        ipaddress.IPv6Address: The addresses in numeric order.
+    """
+    conn = sqlite3.connect(path)
+    try:
+        for ip, in conn.execute('SELECT ip FROM ip6_addresses ORDER BY ip'):
+            yield ipaddress.IPv6Address(ip)
+    finally:
+        conn.close()
+
+
+def hitlist_candidates(sources, path=DB_PATH):
+    """
+    Streams the candidate addresses of the given hit-list sources.
+
+    Args:
+        sources (list): Each one either "@file" (an address list, DHCPv6 log or lease
+            file), "neighbors" (the IPv6 neighbor cache), "previous" (the addresses
+            stored by earlier scans), an IPv6 address, or an IPv6 network of at most
+            65536 addresses.
+        path (str): Path of the SQLite database file, for "previous".
+
+    Yields:
+        ipaddress.IPv6Address: The candidates, duplicates included.
+
+    Raises:
+        ValueError: If a source is neither of the above.
+    """
+    for source in sources:
+        if source.startswith('@'):
+            yield from read_hitlist_file(source[1:])
+        elif source == 'neighbors':
+            yield from map(ipaddress.IPv6Address, read_ipv6_neighbors())
+        elif source == 'previous':
+            yield from previous_ipv6_hosts(path)
+        elif '/' in source:
+            network = ipaddress.IPv6Network(source, strict=False)
+            if network.num_addresses > 65536:
+                raise ValueError(f"IPv6 network too large to enumerate, use a hit list: {source}")
+            yield from filter(None, map(hitlist_address, map(str, network.hosts())))
+        else:
+            address = hitlist_address(source)
+            if address is None:
+                raise ValueError(f"Not a usable IPv6 hit-list source: {source}")
+            yield address
+
+
+class HitList:
+    """
+    IPv6 candidate addresses of a hit-list scan, deduplicated in a private
+    temporary SQLite database that spills to disk. Like a TargetSet it is
+    addressable by index and iterated lazily, so memory stays bounded however
+    many candidates the sources produce.
+    """
+
+    def __init__(self, conn=None, start=0, stop=0):
+        """
+        Initializes an empty list, or a slice of an existing one.
+
+        Args:
+            conn (sqlite3.Connection): Database of the list being sliced, None to create one.
+            start (int): Index of the first address of the slice.
+            stop (int): Index past the last address of the slice.
+        """
+        if conn is None:
+            # An empty file name opens a temporary database deleted on close
+            conn = sqlite3.connect('')
+            conn.execute('CREATE TABLE hosts (n INTEGER PRIMARY KEY, ip BLOB UNIQUE)')
+        self._conn = conn
+        self.start = start
+        self.stop = stop
+        self._name = None
+
+    @classmethod
+    def load(cls, sources, exclude=(), path=DB_PATH, batch_size=10000):
+        """
+        Builds a list from hit-list sources (see hitlist_candidates), keeping the
+        first occurrence of every address.
+
+        Args:
+            sources (list): The candidate sources.
+            exclude (list): IPv6 networks or addresses to leave out; other specifications are ignored.
+            path (str): Path of the SQLite database file, for "previous".
+            batch_size (int): Number of candidates inserted per statement.
+
+        Returns:
+            HitList: The list.
+        """
+        hitlist = cls()
+        excluded = [ipaddress.IPv6Network(spec, strict=False) for spec in exclude or () if ':' in spec]
+        sql = 'INSERT OR IGNORE INTO hosts (ip) VALUES (?)'
+        batch = []
+        for address in hitlist_candidates(sources, path):
+            if any(address in network for network in excluded):
+                continue
+            batch.append((address.packed,))
+            if len(batch) >= batch_size:
+                hitlist._conn.executemany(sql, batch)
+                batch.clear()
+        hitlist._conn.executemany(sql, batch)
+        # Ignored duplicates take no rowid, so the rowids are exactly 1..count
+        hitlist.stop = hitlist._conn.execute('SELECT COUNT(*) FROM hosts').fetchone()[0]
+        return hitlist
+
+    def shard(self, index, count):
+        """
+        Returns one of `count` contiguous, near-equal slices of this list.
+
+        Args:
+            index (int): Zero-based index of the shard.
+            count (int): Total number of shards.
+
+        Returns:
+            HitList: The shard.
+        """
+        size = len(self)
+        return HitList(self._conn, self.start + index * size // count, self.start + (index + 1) * size // count)
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def __getitem__(self, index):
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        row = self._conn.execute('SELECT ip FROM hosts WHERE n = ?', (self.start + index + 1,)).fetchone()
+        return bytes_to_ip6(row[0])
+
+    def __iter__(self):
+        rows = self._conn.execute('SELECT ip FROM hosts WHERE n > ? AND n <= ? ORDER BY n', (self.start, self.stop))
+        for ip, in rows:
+            yield bytes_to_ip6(ip)
+
+    def __str__(self):
+        if self._name is None:
+            digest = hashlib.sha1()
+            for ip, in self._conn.execute('SELECT ip FROM hosts WHERE n > ? AND n <= ? ORDER BY n',
+                                          (self.start, self.stop)):
+                digest.update(ip)
+            self._name = 'hitlist:' + digest.hexdigest()[:16]
+        return self._name
+
+
+class ScanCheckpoint:
+    """
+    Records scan-run metadata and per-chunk progress in the database, so that an
+    interrupted scan can be resumed without probing completed chunks again.
+
+    Chunks are consecutive positions in scan order, so progress also holds for
+    permuted scans. A chunk is marked complete through the result writer after all
+    of its hosts have been queued, so progress is never committed ahead of the
+    results it covers.
+    """
+
+    def __init__(self, writer, target, chunk_size=256, resume=False, ttl=None, path=DB_PATH):
+        """
+        Initializes the checkpoint without touching the database.
+
+        Args:
+            writer (ResultWriter): The writer that commits results and progress.
+            target (str): Identifies the scanned address set, e.g. the CIDR.
+            chunk_size (int): Number of consecutive hosts tracked as one unit of progress.
+            resume (bool): Continue the last unfinished run of the same target.
+            ttl (float): If set, skip hosts observed less than this many seconds ago.
+            path (str): Path of the SQLite database file.
+        """
+        self.writer = writer
+        self.target = target
+        self.chunk_size = chunk_size
+        self.resume = resume
+        self.ttl = ttl
+        self.path = path
+        self.run_id = None
+        self._done = set()
+        self._remaining = {}
+        self._conn = None
+
+    def open(self):
+        """
+        Starts a new run, or picks up the last unfinished run of the same target in resume mode.
+        """
+        self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        row = None
+        if self.resume:
+            row = self._conn.execute(
+                'SELECT id FROM scan_runs WHERE target = ? AND chunk_size = ? AND finished_at IS NULL '
+                'ORDER BY id DESC LIMIT 1', (self.target, self.chunk_size)).fetchone()
+        if row:
+            self.run_id = row[0]
+            self._done = {chunk for chunk, in self._conn.execute(
+                'SELECT chunk FROM scan_progress WHERE run_id = ?', (self.run_id,))}
+            logger.info(f"Resuming scan run {self.run_id}: {len(self._done)} chunks already completed")
+        else:
+            with self._conn:
+                self.run_id = self._conn.execute(
+                    'INSERT INTO scan_runs (target, chunk_size, started_at) VALUES (?, ?, ?)',
+                    (self.target, self.chunk_size, time.time())).lastrowid
+
+    def incomplete_chunks(self):
+        """
+        Returns the number of chunks handed out in this run that still have
+        unprocessed hosts, because processing some of them failed.
+
+        Returns:
+            int: The number of incomplete chunks.
+        """
+        return len(self._remaining)
+
+    async def finish(self):
+        """
+        Marks the run as finished, once every queued result has been committed.
+        """
+        await self.writer.execute('UPDATE scan_runs SET finished_at = ? WHERE id = ?', (time.time(), self.run_id))
+        self.close()
+
+    def close(self):
+        """
+        Closes the checkpoint's connection, leaving an unfinished run open for resume.
+        """
+        self._conn.close()
+
+    def _fresh_hosts(self, ips):
+        """
+        Returns the hosts among the given ones that were observed within the TTL.
+
+        Args:
+            ips (list): IP addresses to look up.
+
+        Returns:
+            set: The IP addresses that do not need to be probed again.
+        """
+        placeholders = ','.join('?' * len(ips))
+        if ':' in ips[0]:
+            rows = self._conn.execute(
+                f'SELECT ip FROM ip6_addresses WHERE ip IN ({placeholders}) AND last_seen >= ?',
+                (*map(ip6_to_bytes, ips), time.time() - self.ttl))
+            return {bytes_to_ip6(ip) for ip, in rows}
+        rows = self._conn.execute(
+            f'SELECT ip FROM ip_addresses WHERE ip IN ({placeholders}) AND last_seen >= ?',
+            (*map(ip_to_int, ips), time.time() - self.ttl))
+        return {int_to_ip(ip) for ip, in rows}
+
+    async def pending(self, hosts):
+        """
+        Yields the hosts still to be probed in this run, chunk by chunk.
+
+        Args:
+            hosts (TargetSet): The indexable address set or HitList being scanned, in scan order.
+
+        Yields:
+            tuple: (ip, chunk) pairs, to be passed back to host_done() once processed.
+        """
+        for chunk in range(math.ceil(len(hosts) / self.chunk_size)):
+            if chunk in self._done:
+                continue
+            start = chunk * self.chunk_size
+            ips = [hosts[i] for i in range(start, min(start + self.chunk_size, len(hosts)))]
+            if self.ttl is not None:
+                fresh = await asyncio.to_thread(self._fresh_hosts, ips)
+                ips = [ip for ip in ips if ip not in fresh]
+            if not ips:
+                await self._complete(chunk)
+                continue
+            self._remaining[chunk] = len(ips)
+            for ip in ips:
+                yield ip, chunk
+
+    async def host_done(self, chunk):
+        """
+        Counts a processed host and marks its chunk complete once all of them are done.
+
+        Args:
+            chunk (int): The chunk the host belongs to.
+        """
+        self._remaining[chunk] -= 1
+        if self._remaining[chunk] == 0:
+            del self._remaining[chunk]
+            await self._complete(chunk)
+
+    async def _complete(self, chunk):
+        await self.writer.execute(
+            'INSERT OR REPLACE INTO scan_progress (run_id, chunk, completed_at) VALUES (?, ?, ?)',
+            (self.run_id, chunk, time.time()))
+
+
+_icmp_engines = {}
+
+
+def get_icmp_engine(family=socket.AF_INET):
+    """
+    Returns the shared ICMP echo engine of the running event loop, opening it on first use.
+    Engines are kept per event loop and address family; those of loops that have
+    been closed are dropped, so every asyncio.run() opens its own socket and
+    retries one that failed to open before.
+
+    Args:
+        family (int): socket.AF_INET or socket.AF_INET6.
+
+    Returns:
+        ICMPEchoEngine: The engine, or None if no ICMP socket could be opened and
+        pings have to fall back to the ping subprocess.
+    """
+    for key in [key for key in _icmp_engines if key[0].is_closed()]:
+        engine = _icmp_engines.pop(key)
+        if engine is not None:
+            engine.close()
+    key = (asyncio.get_running_loop(), family)
+    if key not in _icmp_engines:
+        engine = ICMPEchoEngine(family=family)
+        try:
+            engine.open()
+            _icmp_engines[key] = engine
+        except OSError as e:
+            logger.warning(f"ICMP socket unavailable, falling back to ping subprocess: {e}")
+            _icmp_engines[key] = None
+    return _icmp_engines[key]
+
+
+def close_icmp_engine():
+    """
+    Closes the shared ICMP echo engines of the running event loop.
+    """
+    loop = asyncio.get_running_loop()
+    for key in [key for key in _icmp_engines if key[0] is loop]:
+        engine = _icmp_engines.pop(key)
+        if engine is not None:
+            engine.close()
+
+
+async def ping_rtt(ip, timeout=1.0):
+    """
+    Pings the specified IP address and measures the round-trip time.
+
+    Uses the shared ICMP echo engine when available and falls back to the system
+    ping command otherwise.
+
+    Args:
+        ip (str): The IP address to ping.
+        timeout (float): Seconds to wait for the reply.
+
+    Returns:
+        float: The round-trip time in seconds, or None if the IP did not respond.
+    """
+    family = socket.AF_INET6 if ':' in ip else socket.AF_INET
+    engine = get_icmp_engine(family)
+    if engine is not None:
+        return await engine.ping(ip, timeout)
+    version = '-6' if family == socket.AF_INET6 else '-4'
+    try:
+        result = await asyncio.to_thread(subprocess.run, ['ping', version, '-c', '1', '-W', f'{timeout:.3f}', ip],
+                                         stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except Exception as e:
+        logger.warning(f"Ping failed: {ip} - Error: {e}")
+        return None
+    if result.returncode != 0:
+        return None
+    match = re.search(rb'time[=<]([\d.]+) ms', result.stdout)
+    return float(match.group(1)) / 1000 if match else timeout
+
+
+async def ping_ip(ip, timeout=1.0):
+    """
+    Pings the specified IP address to check if it's active.
+
+    Args:
+        ip (str): The IP address to ping.
+        timeout (float): Seconds to wait for the reply.
+
+    Returns:
+        bool: True if the IP is active (responds to ping), False otherwise.
+    """
+    return await ping_rtt(ip, timeout) is not None
+
+
+async def tcp_connect_state(ip, port, timeout=1.0):
+    """
+    Opens and immediately closes a TCP connection, without exchanging any data.
+
+    Args:
+        ip (str): The IP address to probe.
+        port (int): The TCP port to connect to.
+        timeout (float): Seconds to wait for the connection to be established.
+
+    Returns:
+        bool: True if the connection was accepted, False if it was refused (the host
+        is up but the port is closed), None if there was no answer.
+    """
+    loop = asyncio.get_running_loop()
+    sock = socket.socket(socket.AF_INET6 if ':' in ip else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setblocking(False)
+    try:
+        await asyncio.wait_for(loop.sock_connect(sock, (ip, port)), timeout)
+        return True
+    except ConnectionRefusedError:
+        return False
+    except (asyncio.TimeoutError, OSError):
+        return None
+    finally:
+        sock.close()
+
+
+async def probe_tcp_port(ip, port=22, timeout=1.0):
+    """
+    Checks whether a TCP port accepts connections, without exchanging any data.
+
+    Args:
+        ip (str): The IP address to probe.
+        port (int): The TCP port to connect to.
+        timeout (float): Seconds to wait for the connection to be established.
+
+    Returns:
+        bool: True if the connection was accepted, False if it was refused or timed out.
+    """
+    return await tcp_connect_state(ip, port, timeout) is True
+
+
+ROUTE_TABLE_PATH = '/proc/net/route'
+NEIGHBOR_LIMIT_PATH = '/proc/sys/net/ipv4/neigh/default/gc_thresh3'
+
 
+def read_neighbor_table():
+    """
+    Reads the kernel IPv4 neighbor (ARP) table with the state of every entry.
+    /proc/net/arp is not used, since it marks STALE entries complete as well and
+    those may belong to hosts that left long ago.
 
-def create_db():
+    Returns:
+        dict: Maps each address to its neighbor state, e.g. "REACHABLE". Empty if
+        the table cannot be read.
     """
-    Creates the SQLite database and the necessary table to store IP addresses
-    and their statuses (active, SSH connected).
+    try:
+        result = subprocess.run(['ip', '-4', 'neigh', 'show'], stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                text=True, check=True)
+    except (OSError, subprocess.CalledProcessError) as e:
+        logger.debug(f"Neighbor table unavailable: {e}")
+        return {}
+    return {fields[0]: fields[-1] for fields in map(str.split, result.stdout.splitlines()) if len(fields) > 1}
+
+
+def neighbor_table_limit(path=NEIGHBOR_LIMIT_PATH):
     """
-    conn = sqlite3.connect('ip_addresses.db')
-    c = conn.cursor()
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS ip_addresses (
-            ip TEXT PRIMARY KEY,
-            is_active INTEGER,
-            is_ssh_connected INTEGER
-        )
-    ''')
-    conn.commit()
-    conn.close()
+    Returns the hard limit of the kernel IPv4 neighbor table (gc_thresh3). Past it
+    the kernel evicts entries, even ones resolved a moment ago.
+
+    Args:
+        path (str): Path of the limit in procfs.
+
+    Returns:
+        int: The maximum number of entries, 1024 if it cannot be read.
+    """
+    try:
+        with open(path) as f:
+            return int(f.read())
+    except (OSError, ValueError):
+        return 1024
 
 
-def save_ip(ip, is_active, is_ssh_connected):
+def local_networks(path=ROUTE_TABLE_PATH):
     """
-    Saves the IP address along with its status (active, SSH connected) in the database.
+    Returns the directly attached IPv4 networks, i.e. the routes without a gateway.
 
     Args:
-        ip (str): The IP address to store.
-        is_active (int): 1 if the IP is active, 0 if not.
-        is_ssh_connected (int): 1 if SSH connection was successful, 0 if not.
+        path (str): Path of the routing table in procfs.
+
+    Returns:
+        list: ipaddress.IPv4Network objects, empty if the table is unavailable.
     """
-    conn = sqlite3.connect('ip_addresses.db')
-    c = conn.cursor()
-    c.execute(
-        'INSERT OR REPLACE INTO ip_addresses (ip, is_active, is_ssh_connected) VALUES (?, ?, ?)',
-        (ip,
-         is_active,
-         is_ssh_connected))
-    conn.commit()
-    conn.close()
+    networks = []
+    try:
+        with open(path) as f:
+            next(f)
+            for fields in map(str.split, f):
+                destination, gateway, mask = (int(fields[i], 16) for i in (1, 2, 7))
+                if gateway == 0 and mask != 0:
+                    # The table holds addresses in host (little-endian) byte order
+                    address = socket.inet_ntoa(struct.pack('<I', destination))
+                    netmask = socket.inet_ntoa(struct.pack('<I', mask))
+                    networks.append(ipaddress.IPv4Network(f"{address}/{netmask}"))
+    except (OSError, StopIteration, IndexError, ValueError) as e:
+        logger.debug(f"Routing table unavailable: {e}")
+    return networks
 
 
-async def ping_ip(ip):
+async def discover_neighbors(hosts, prime=False, settle=1.0, limiter=None, batch_size=None):
     """
-    Pings the specified IP address to check if it's active.
+    Finds the hosts of a scan that the kernel neighbor table has confirmed alive,
+    so their ping can be skipped. Only REACHABLE entries count: STALE entries may
+    outlive their host indefinitely while the table is small.
+
+    When priming, a single empty UDP datagram is sent to every host on a directly
+    attached network first, which makes the kernel resolve them without waiting for
+    any reply on our side. Hosts are primed and read back in batches of half the
+    table limit, so the kernel does not evict entries before they are read.
 
     Args:
-        ip (str): The IP address to ping.
+        hosts (iterable): The addresses being scanned.
+        prime (bool): Send the priming datagrams before reading the table.
+        settle (float): Seconds to wait for address resolution after each priming batch.
+        limiter (RateLimiter): If given, priming datagrams draw from the packet budget.
+        batch_size (int): Hosts primed per batch, half of neighbor_table_limit() if None.
 
     Returns:
-        bool: True if the IP is active (responds to ping), False otherwise.
+        set: The IP addresses to treat as active without pinging.
     """
+    networks = local_networks()
+    if not networks:
+        return set()
+    if not prime:
+        neighbors = {ip for ip, state in read_neighbor_table().items() if state == 'REACHABLE'
+                     and any(ipaddress.IPv4Address(ip) in network for network in networks)}
+        logger.info(f"Neighbor table lists {len(neighbors)} reachable local hosts")
+        return neighbors
+
+    loop = asyncio.get_running_loop()
+    batch_size = batch_size or max(1, neighbor_table_limit() // 2)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setblocking(False)
+    neighbors = set()
+    primed = 0
+
+    async def prime_batch(batch):
+        nonlocal primed
+        primed += len(batch)
+        for ip in batch:
+            if limiter is not None:
+                await limiter.packet()
+            try:
+                await loop.sock_sendto(sock, b'', (ip, 9))
+            except OSError:
+                pass
+        await asyncio.sleep(settle)
+        table = read_neighbor_table()
+        neighbors.update(ip for ip in batch if table.get(ip) == 'REACHABLE')
+
     try:
-        result = await asyncio.to_thread(subprocess.run, ['ping', '-c', '1', ip], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        return result.returncode == 0
-    except Exception as e:
-        logger.warning(f"Ping failed: {ip} - Error: {e}")
+        batch = []
+        for ip in hosts:
+            if not any(ipaddress.IPv4Address(ip) in network for network in networks):
+                continue
+            batch.append(ip)
+            if len(batch) == batch_size:
+                await prime_batch(batch)
+                batch = []
+        if batch:
+            await prime_batch(batch)
+    finally:
+        sock.close()
+    logger.info(f"Primed the neighbor cache for {primed} local hosts, {len(neighbors)} reachable")
+    return neighbors
+
+
+class TokenBucket:
+    """
+    Token bucket that admits a steady rate of events while letting short bursts
+    through up to the bucket capacity. Waiters are served in arrival order.
+    """
+
+    def __init__(self, rate, burst):
+        """
+        Initializes a full bucket.
+
+        Args:
+            rate (float): Tokens added per second.
+            burst (float): Bucket capacity, i.e. the largest burst admitted at once.
+        """
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.granted = 0
+        self.waited = 0.0
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+        self._sampled = 0
+        self._sampled_at = self._updated
+
+    async def acquire(self):
+        """
+        Waits until a token is available and takes it.
+        """
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    break
+                delay = (1 - self._tokens) / self.rate
+                self.waited += delay
+                await asyncio.sleep(delay)
+        self.granted += 1
+
+    def sample_rate(self):
+        """
+        Returns the rate at which tokens were granted since the previous call.
+
+        Returns:
+            float: Tokens per second.
+        """
+        now = time.monotonic()
+        rate = (self.granted - self._sampled) / max(now - self._sampled_at, 1e-9)
+        self._sampled = self.granted
+        self._sampled_at = now
+        return rate
+
+
+class RateLimiter:
+    """
+    Global packets-per-second and new-connections-per-second budget shared by the
+    ping, port probe and SSH stages of process_ip. A limit of None means unlimited.
+    """
+
+    def __init__(self, packets_per_second=None, connections_per_second=None, burst=0.2):
+        """
+        Initializes the limiter.
+
+        Args:
+            packets_per_second (float): Maximum rate of ICMP echo requests.
+            connections_per_second (float): Maximum rate of new TCP connections.
+            burst (float): Seconds worth of tokens that may be spent at once.
+        """
+        self.packets = TokenBucket(packets_per_second, packets_per_second * burst) if packets_per_second else None
+        self.connections = (TokenBucket(connections_per_second, connections_per_second * burst)
+                            if connections_per_second else None)
+
+    async def packet(self):
+        """
+        Waits for the budget to send one probe packet.
+        """
+        if self.packets is not None:
+            await self.packets.acquire()
+
+    async def connection(self):
+        """
+        Waits for the budget to open one new connection.
+        """
+        if self.connections is not None:
+            await self.connections.acquire()
+
+    def report(self):
+        """
+        Returns a one-line summary of the live rates since the previous report.
+
+        Returns:
+            str: The summary, or None if no limit is configured.
+        """
+        parts = []
+        for name, bucket in (("pkt/s", self.packets), ("conn/s", self.connections)):
+            if bucket is not None:
+                parts.append(f"{bucket.sample_rate():.0f}/{bucket.rate:.0f} {name} (waited {bucket.waited:.1f}s)")
+        return ", ".join(parts) or None
+
+
+PHASES = ('ping', 'tcp_probe', 'ssh', 'db_write')
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Histogram:
+    """
+    Fixed-bucket latency histogram with the cumulative buckets, sum and count
+    of a Prometheus histogram.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        """
+        Initializes an empty histogram.
+
+        Args:
+            buckets (tuple): Ascending upper bounds in seconds; larger values only count towards +Inf.
+        """
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        """
+        Adds one sample.
+
+        Args:
+            value (float): The sample in seconds.
+        """
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name, labels):
+        """
+        Formats the histogram in the Prometheus text format.
+
+        Args:
+            name (str): The metric name.
+            labels (str): Label pairs without braces, e.g. 'phase="ping"'.
+
+        Returns:
+            list: The sample lines.
+        """
+        lines = []
+        total = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            total += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {total}')
+        lines.append(f'{name}_sum{{{labels}}} {self.sum}')
+        lines.append(f'{name}_count{{{labels}}} {self.count}')
+        return lines
+
+
+class ScanMetrics:
+    """
+    Counters, per-phase latency histograms and in-flight gauges of a scan, shared
+    by the scanner and the result writer. Exposed as Prometheus text by
+    serve_metrics() and summarized in the log by report_progress().
+    """
+
+    def __init__(self, expected=None):
+        """
+        Initializes zeroed metrics.
+
+        Args:
+            expected (int): Number of hosts the scan covers, if known.
+        """
+        self.expected = expected
+        self.started = time.monotonic()
+        self.hosts = 0
+        self.active = 0
+        self.port_open = 0
+        self.connected = 0
+        self.errors = 0
+        self.ssh_failures = {}
+        self.statements = 0
+        self.write_queue = None
+        self.latency = {phase: Histogram() for phase in PHASES}
+        self.in_flight = dict.fromkeys(PHASES, 0)
+        self.cancelled = dict.fromkeys(PHASES, 0)
+        self._sampled = 0
+        self._sampled_at = self.started
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """
+        Times the enclosed block as one operation of a phase and counts it as in
+        flight meanwhile. Operations cancelled by the liveness race are counted but
+        not timed, so the histograms only hold completed probes.
+
+        Args:
+            name (str): One of PHASES.
+        """
+        self.in_flight[name] += 1
+        started = time.perf_counter()
+        try:
+            yield
+        except asyncio.CancelledError:
+            self.cancelled[name] += 1
+            raise
+        else:
+            self.latency[name].observe(time.perf_counter() - started)
+        finally:
+            self.in_flight[name] -= 1
+
+    def result(self, is_active, is_ssh_port_open, is_ssh_connected):
+        """
+        Counts the recorded result of one host.
+
+        Args:
+            is_active (int): 1 if the IP is active, 0 if not.
+            is_ssh_port_open (int): 1 if TCP port 22 accepted a connection, 0 if not.
+            is_ssh_connected (int): 1 if SSH connection was successful, 0 or None if not.
+        """
+        self.hosts += 1
+        self.active += bool(is_active)
+        self.port_open += bool(is_ssh_port_open)
+        self.connected += is_ssh_connected == 1
+
+    def ssh_failure(self, stage, error):
+        """
+        Counts an SSH failure that is expected for many hosts, e.g. a rejected login,
+        by error class instead of logging it.
+
+        Args:
+            stage (str): "login" or "host_key".
+            error (Exception): The error of the last attempt.
+        """
+        key = (stage, type(error).__name__)
+        self.ssh_failures[key] = self.ssh_failures.get(key, 0) + 1
+
+    def rate(self):
+        """
+        Returns the average number of hosts recorded per second since the scan started.
+
+        Returns:
+            float: Hosts per second.
+        """
+        return self.hosts / max(time.monotonic() - self.started, 1e-9)
+
+    def summary(self):
+        """
+        Returns a one-line progress summary, with the host rate since the previous summary.
+
+        Returns:
+            str: The summary.
+        """
+        now = time.monotonic()
+        rate = (self.hosts - self._sampled) / max(now - self._sampled_at, 1e-9)
+        self._sampled = self.hosts
+        self._sampled_at = now
+        done = f"{self.hosts}/{self.expected}" if self.expected is not None else str(self.hosts)
+        in_flight = " ".join(f"{phase}={count}" for phase, count in self.in_flight.items())
+        queue = self.write_queue.qsize() if self.write_queue is not None else 0
+        return (f"{done} hosts ({rate:.0f}/s), {self.active} active, {self.port_open} ssh open, "
+                f"{self.connected} connected, {sum(self.ssh_failures.values())} ssh failures, {self.errors} errors "
+                f"| in flight: {in_flight} | write queue {queue}")
+
+    def render(self):
+        """
+        Formats every metric in the Prometheus text exposition format.
+
+        Returns:
+            str: The exposition.
+        """
+        lines = []
+        for name, value, help_text in (
+                ('q1_hosts_total', self.hosts, 'Hosts whose result was recorded.'),
+                ('q1_hosts_active_total', self.active, 'Hosts found active.'),
+                ('q1_ssh_port_open_total', self.port_open, 'Hosts with TCP port 22 open.'),
+                ('q1_ssh_connected_total', self.connected, 'Hosts that accepted the SSH login.'),
+                ('q1_host_errors_total', self.errors, 'Hosts whose processing failed.'),
+                ('q1_db_statements_total', self.statements, 'Statements committed by the result writer.')):
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter', f'{name} {value}']
+        lines += ['# HELP q1_ssh_failures_total SSH logins and host key retrievals that failed, by error class.',
+                  '# TYPE q1_ssh_failures_total counter']
+        lines += [f'q1_ssh_failures_total{{stage="{stage}",error="{error}"}} {count}'
+                  for (stage, error), count in sorted(self.ssh_failures.items())]
+        lines += ['# HELP q1_hosts_per_second Average hosts recorded per second since the scan started.',
+                  '# TYPE q1_hosts_per_second gauge', f'q1_hosts_per_second {self.rate()}']
+        if self.expected is not None:
+            lines += ['# HELP q1_hosts_expected Hosts covered by the scan.', '# TYPE q1_hosts_expected gauge',
+                      f'q1_hosts_expected {self.expected}']
+        if self.write_queue is not None:
+            lines += ['# HELP q1_write_queue_depth Statements waiting for the result writer.',
+                      '# TYPE q1_write_queue_depth gauge', f'q1_write_queue_depth {self.write_queue.qsize()}']
+        lines += ['# HELP q1_phase_in_flight Operations of each phase in progress.', '# TYPE q1_phase_in_flight gauge']
+        lines += [f'q1_phase_in_flight{{phase="{phase}"}} {count}' for phase, count in self.in_flight.items()]
+        lines += ['# HELP q1_phase_cancelled_total Operations of each phase cancelled before completing.',
+                  '# TYPE q1_phase_cancelled_total counter']
+        lines += [f'q1_phase_cancelled_total{{phase="{phase}"}} {count}' for phase, count in self.cancelled.items()]
+        lines += ['# HELP q1_phase_seconds Duration of the completed operations of each phase.',
+                  '# TYPE q1_phase_seconds histogram']
+        for phase, histogram in self.latency.items():
+            lines += histogram.render('q1_phase_seconds', f'phase="{phase}"')
+        return '\n'.join(lines) + '\n'
+
+
+async def serve_metrics(metrics, host='127.0.0.1', port=9108):
+    """
+    Starts an HTTP endpoint serving the metrics in the Prometheus text format at /metrics.
+
+    Args:
+        metrics (ScanMetrics): The metrics to expose.
+        host (str): Address to listen on.
+        port (int): TCP port to listen on.
+
+    Returns:
+        web.AppRunner: The running server, to be stopped with cleanup().
+    """
+    async def handle(request):
+        return web.Response(body=metrics.render().encode(),
+                            headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'})
+
+    app = web.Application()
+    app.router.add_get('/metrics', handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"Serving metrics on http://{host}:{port}/metrics")
+    return runner
+
+
+async def report_progress(metrics, limiter, interval=10.0):
+    """
+    Periodically logs a one-line progress summary and the live probe and
+    connection rates until cancelled.
+
+    Args:
+        metrics (ScanMetrics): The metrics to summarize.
+        limiter (RateLimiter): The limiter to report on.
+        interval (float): Seconds between reports.
+    """
+    while True:
+        await asyncio.sleep(interval)
+        rates = limiter.report()
+        logger.info(f"Progress: {metrics.summary()}" + (f" | rate: {rates}" if rates else ""))
+
+
+async def grab_ssh_banner(ip, port=22, timeout=2.0, max_lines=16):
+    """
+    Connects to an SSH server and reads its identification string ("SSH-2.0-...")
+    without starting the key exchange.
+
+    Args:
+        ip (str): The IP address to connect to.
+        port (int): The SSH port.
+        timeout (float): Seconds allowed for connecting and reading the banner.
+        max_lines (int): Maximum number of lines the server may send before its
+            identification string (RFC 4253, section 4.2).
+
+    Returns:
+        tuple: (is_port_open, banner) where banner is the identification string,
+        or None if the server did not send one in time.
+    """
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(ip, port), timeout)
+    except (asyncio.TimeoutError, OSError):
+        return False, None
+    try:
+        for _ in range(max_lines):
+            line = await asyncio.wait_for(reader.readline(), timeout)
+            if not line:
+                break
+            if line.startswith(b'SSH-'):
+                return True, line.decode('ascii', 'replace').strip()
+    except (asyncio.TimeoutError, OSError, ValueError):
+        pass
+    finally:
+        writer.close()
+    return True, None
+
+
+def parse_ssh_banner(banner):
+    """
+    Splits an SSH identification string into server software and version, e.g.
+    "SSH-2.0-OpenSSH_8.9p1 Ubuntu-3" into ("OpenSSH", "8.9p1").
+
+    Args:
+        banner (str): The identification string, or None.
+
+    Returns:
+        tuple: (software, version), with None for the parts that are missing.
+    """
+    match = re.match(r'SSH-[\d.]+-([^\s_]+)(?:_(\S+))?', banner or '')
+    if not match:
+        return None, None
+    return match.group(1), match.group(2)
+
+
+def describe_host_key(key):
+    """
+    Returns the type and SHA256 fingerprint of an SSH host key.
+
+    Args:
+        key (asyncssh.SSHKey): The key, or None.
+
+    Returns:
+        tuple: (key_type, fingerprint), or None if no key was given.
+    """
+    if key is None:
+        return None
+    return key.get_algorithm(), key.get_fingerprint()
+
+
+async def fetch_host_key(ip, timeout=5.0, metrics=None):
+    """
+    Runs only the SSH key exchange with the given IP address to learn its host key,
+    without authenticating.
+
+    Args:
+        ip (str): The IP address to connect to.
+        timeout (float): Seconds allowed for the key exchange.
+        metrics (ScanMetrics): If given, counts the failure by error class.
+
+    Returns:
+        tuple: (key_type, fingerprint), or None if the key could not be retrieved.
+    """
+    try:
+        key = await asyncio.wait_for(asyncssh.get_server_host_key(ip), timeout)
+    except (asyncssh.Error, OSError, asyncio.TimeoutError) as e:
+        logger.debug(f"SSH host key retrieval failed: {ip} - Error: {e!r}")
+        if metrics is not None:
+            metrics.ssh_failure("host_key", e)
+        return None
+    return describe_host_key(key)
+
+
+SSH_PERMANENT_ERRNOS = {errno.ECONNREFUSED, errno.EHOSTUNREACH, errno.ENETUNREACH, errno.EHOSTDOWN}
+
+
+def classify_ssh_error(error):
+    """
+    Sorts an SSH connection error into the retry classes of RetryPolicy.
+
+    Authentication failures, refused connections, unreachable hosts and protocol
+    mismatches will fail the same way again. Dropped connections, e.g. servers
+    shedding load past MaxStartups, are worth retrying.
+
+    Args:
+        error (Exception): The error raised while connecting.
+
+    Returns:
+        str: "permanent", "transient" or "timeout".
+    """
+    if isinstance(error, (asyncio.TimeoutError, TimeoutError)):
+        return "timeout"
+    if isinstance(error, (asyncssh.PermissionDenied, asyncssh.HostKeyNotVerifiable,
+                          asyncssh.KeyExchangeFailed, asyncssh.ProtocolNotSupported)):
+        return "permanent"
+    if isinstance(error, asyncssh.DisconnectError):
+        if error.code in (asyncssh.DISC_TOO_MANY_CONNECTIONS, asyncssh.DISC_CONNECTION_LOST):
+            return "transient"
+        return "permanent"
+    if isinstance(error, OSError) and error.errno in SSH_PERMANENT_ERRNOS:
+        return "permanent"
+    return "transient"
+
+
+class RetryPolicy:
+    """
+    Decides whether and when a failed SSH connection attempt is retried. Only
+    transient errors are retried by default, after an exponential backoff with
+    full jitter, and no attempt starts after the per-host deadline.
+    """
+
+    def __init__(self, retries=3, base_delay=0.25, max_delay=4.0, deadline=15.0, attempt_timeout=10.0,
+                 retry_timeouts=False):
+        """
+        Initializes the policy.
+
+        Args:
+            retries (int): Maximum number of attempts per host.
+            base_delay (float): Upper bound in seconds of the first backoff, doubled after every attempt.
+            max_delay (float): Upper bound in seconds of any single backoff.
+            deadline (float): Seconds after the first attempt by which the host must be done.
+            attempt_timeout (float): Seconds allowed for a single connection and login.
+            retry_timeouts (bool): Whether timed out attempts are retried like transient errors.
+        """
+        self.retries = retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.attempt_timeout = attempt_timeout
+        self.retry_timeouts = retry_timeouts
+
+    def should_retry(self, kind):
+        """
+        Returns whether an error of the given class is retried.
+
+        Args:
+            kind (str): The class returned by classify_ssh_error().
+
+        Returns:
+            bool: True if another attempt may be made.
+        """
+        return kind == "transient" or (kind == "timeout" and self.retry_timeouts)
+
+    def backoff(self, attempt):
+        """
+        Returns the delay before the next attempt.
+
+        Args:
+            attempt (int): Number of attempts made so far.
+
+        Returns:
+            float: Seconds to wait, drawn uniformly from [0, min(max_delay, base_delay * 2 ** (attempt - 1))].
+        """
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+
+class ServerIdentityCapture(asyncssh.SSHClient):
+    """
+    SSH client callbacks that remember the identification string and host key the
+    server presented, so they can be recorded even when the key is not trusted or
+    the login is rejected. Untrusted keys are still rejected, as without the callbacks.
+    """
+
+    def __init__(self):
+        self.conn = None
+        self.key = None
+
+    def connection_made(self, conn):
+        self.conn = conn
+
+    def validate_host_public_key(self, host, addr, port, key):
+        self.key = key
         return False
 
+    def host_key(self):
+        """
+        Returns the host key presented by the server.
+
+        Returns:
+            asyncssh.SSHKey: The key, or None if the key exchange did not get that far.
+        """
+        if self.conn is not None and self.conn.get_server_host_key() is not None:
+            return self.conn.get_server_host_key()
+        return self.key
+
+    def banner(self):
+        """
+        Returns the identification string sent by the server.
+
+        Returns:
+            str: The banner, or None if the connection did not get that far.
+        """
+        return self.conn.get_extra_info('server_version') if self.conn is not None else None
+
+
+async def ssh_login(ip, username='root', password='password', retries=3, limiter=None, policy=None, metrics=None):
+    """
+    Attempts to establish an SSH connection to the given IP address and reports the
+    banner and host key the server presented, also when the key is not trusted or
+    the login is rejected. Failed attempts are retried as the retry policy allows. Failures
+    are logged at debug level only, since rejected logins and unknown host keys
+    are the common case in a sweep.
+
+    Args:
+        ip (str): The IP address to connect to via SSH.
+        username (str): The username for SSH login.
+        password (str): The password for SSH login.
+        retries (int): The number of attempts, used when no policy is given.
+        limiter (RateLimiter): If given, every attempt waits for the connection budget.
+        policy (RetryPolicy): The retry policy, by default RetryPolicy(retries).
+        metrics (ScanMetrics): If given, counts a failed login by the error class of its last attempt.
+
+    Returns:
+        tuple: (connected, host_key, banner) where host_key is (key_type, fingerprint),
+        or None if no attempt got through the key exchange, and banner is the
+        server's identification string, or None if no attempt received it.
+    """
+    policy = policy or RetryPolicy(retries)
+    deadline = time.monotonic() + policy.deadline
+    attempt = 0
+    host_key = banner = None
+    while True:
+        if limiter is not None:
+            await limiter.connection()
+        attempt += 1
+        remaining = deadline - time.monotonic()
+        client = ServerIdentityCapture()
+        try:
+            if remaining <= 0:
+                raise asyncio.TimeoutError()
+            conn = await asyncio.wait_for(
+                asyncssh.connect(ip, username=username, password=password, client_factory=lambda: client),
+                min(policy.attempt_timeout, remaining))
+            async with conn:
+                logger.debug(f"SSH connection successful: {ip}")
+                return True, describe_host_key(conn.get_server_host_key()), conn.get_extra_info('server_version')
+        except (asyncssh.Error, OSError, asyncio.TimeoutError) as e:
+            host_key = describe_host_key(client.host_key()) or host_key
+            banner = client.banner() or banner
+            kind = classify_ssh_error(e)
+            delay = policy.backoff(attempt)
+            if (attempt >= policy.retries or not policy.should_retry(kind)
+                    or time.monotonic() + delay >= deadline):
+                logger.debug(f"SSH connection failed: {ip} - {kind} error after {attempt} attempt(s): {e!r}")
+                if metrics is not None:
+                    metrics.ssh_failure("login", e)
+                return False, host_key, banner
+            logger.debug(f"SSH connection failed: {ip} - Attempt {attempt}/{policy.retries}, "
+                        f"retrying in {delay:.2f}s: {e!r}")
+        await asyncio.sleep(delay)
 
-async def ssh_connect(ip, username='root', password='password', retries=3):
+
+async def ssh_connect(ip, username='root', password='password', retries=3, limiter=None, policy=None):
     """
     Attempts to establish an SSH connection to the given IP address.
 
@@ -74,58 +2341,577 @@ async def ssh_connect(ip, username='root', password='password', retries=3):
         ip (str): The IP address to connect to via SSH.
         username (str): The username for SSH login.
         password (str): The password for SSH login.
-        retries (int): The number of retries if the connection fails.
+        retries (int): The number of attempts, used when no policy is given.
+        limiter (RateLimiter): If given, every attempt waits for the connection budget.
+        policy (RetryPolicy): The retry policy, by default RetryPolicy(retries).
 
     Returns:
         bool: True if SSH connection was successful, False otherwise.
     """
-    attempt = 0
-    while attempt < retries:
+    connected, _, _ = await ssh_login(ip, username, password, retries, limiter, policy)
+    return connected
+
+
+class HostKeyCache:
+    """
+    SSH host key fingerprints and banners seen by earlier sweeps, keyed by IP and
+    key type. Servers with several host keys present whichever type the client
+    negotiates, and the key exchange alone and the login negotiate differently when
+    known_hosts lists some of the types, so only a key of the same type counts as a
+    change. The cache is loaded into memory once per scan; updates and detected key
+    changes are written through the result writer.
+    """
+
+    def __init__(self, writer, path=DB_PATH):
+        """
+        Initializes an empty cache.
+
+        Args:
+            writer (ResultWriter): The writer that stores keys and key changes.
+            path (str): Path of the SQLite database file.
+        """
+        self.writer = writer
+        self.path = path
+        self._keys = {}
+
+    def load(self):
+        """
+        Reads every stored host key from the database.
+        """
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            self._keys = {(ip, key_type): (fingerprint, banner) for ip, key_type, fingerprint, banner in conn.execute(
+                'SELECT ip, key_type, fingerprint, banner FROM ssh_host_keys')}
+        finally:
+            conn.close()
+
+    def get(self, ip, key_type):
+        """
+        Returns the cached host key of an IP address.
+
+        Args:
+            ip (str): The IP address.
+            key_type (str): The host key algorithm, e.g. "ssh-ed25519".
+
+        Returns:
+            tuple: (fingerprint, banner), or None if the host never presented a key of this type.
+        """
+        return self._keys.get((ip_to_int(ip), key_type))
+
+    async def record(self, ip, key_type, fingerprint, banner=None):
+        """
+        Stores the host key an IP address presented, recording a key change event
+        if it differs from the cached key of the same type.
+
+        Args:
+            ip (str): The IP address.
+            key_type (str): The host key algorithm, e.g. "ssh-ed25519".
+            fingerprint (str): The SHA256 fingerprint of the key.
+            banner (str): The server identification string, if it was read.
+
+        Returns:
+            bool: True if the host previously presented a different key of this type.
+        """
+        key = ip_to_int(ip)
+        now = time.time()
+        old = self._keys.get((key, key_type))
+        changed = old is not None and old[0] != fingerprint
+        if changed:
+            logger.warning(f"SSH host key changed: {ip} - {key_type} {old[0]} -> {fingerprint}")
+            await self.writer.execute(HOST_KEY_CHANGE_SQL, (key, now, key_type, old[0], key_type, fingerprint))
+        self._keys[key, key_type] = (fingerprint, banner or (old[1] if old else None))
+        await self.writer.execute(HOST_KEY_SQL, (key, key_type, fingerprint, banner, now, now))
+        return changed
+
+
+class Scanner:
+    """
+    Streams addresses through a fixed-size pool of workers so memory stays flat
+    regardless of the size of the scanned network. The ping and SSH phases of
+    process_ip are bounded by separate concurrency limits.
+    """
+
+    def __init__(self, writer, workers=512, ping_concurrency=512, ssh_concurrency=64,
+                 probe_concurrency=512, probe_timeout=1.0, rtt=None, limiter=None, neighbors=None,
+                 liveness_ports=(), liveness_stagger=0.1, ssh_mode="login", host_keys=None,
+                 ssh_retry=None, metrics=None):
+        """
+        Initializes the scanner limits.
+
+        Args:
+            writer (ResultWriter): The writer receiving the scan results.
+            workers (int): Number of hosts processed concurrently.
+            ping_concurrency (int): Maximum number of pings in flight.
+            ssh_concurrency (int): Maximum number of SSH connection attempts in flight.
+            probe_concurrency (int): Maximum number of port 22 probes in flight.
+            probe_timeout (float): Seconds to wait for port 22 to accept a connection.
+            rtt (RTTEstimator): Estimator providing the ping timeouts.
+            limiter (RateLimiter): Packet and connection budget shared by all stages.
+            neighbors (set): Addresses known to be active from the neighbor table, not pinged.
+            liveness_ports (tuple): TCP ports raced against the ping to detect hosts that drop ICMP.
+            liveness_stagger (float): Head start in seconds given to the ping before the TCP probes.
+            ssh_mode (str): "login" to authenticate over SSH, "banner" to only read the server's
+                identification string, "verify" to log in only to hosts whose banner or host
+                key changed since the last sweep.
+            host_keys (HostKeyCache): Cache receiving the host keys, required in verify mode.
+            ssh_retry (RetryPolicy): Retry policy of the SSH logins.
+            metrics (ScanMetrics): Receives the phase timings and error counts.
+        """
+        self.writer = writer
+        self.ssh_mode = ssh_mode
+        self.host_keys = host_keys
+        self.ssh_retry = ssh_retry or RetryPolicy()
+        self.metrics = metrics or ScanMetrics()
+        self.rtt = rtt or RTTEstimator()
+        self.limiter = limiter or RateLimiter()
+        self.neighbors = neighbors or set()
+        self.workers = workers
+        self.ping_limit = asyncio.Semaphore(ping_concurrency)
+        self.ssh_limit = asyncio.Semaphore(ssh_concurrency)
+        self.probe_limit = asyncio.Semaphore(probe_concurrency)
+        self.probe_timeout = probe_timeout
+        self.liveness_ports = tuple(liveness_ports)
+        self.liveness_stagger = liveness_stagger
+        self.checkpoint = None
+
+    async def _worker(self, queue):
+        """
+        Takes addresses off the queue and processes them until the None sentinel arrives.
+        Hosts whose processing failed are not reported to the checkpoint, so their
+        chunk is probed again when the run is resumed. A failure of the result
+        writer stops the scan, since no further result could be stored.
+
+        Args:
+            queue (asyncio.Queue): The queue fed by run().
+        """
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            ip, chunk = item
+            try:
+                await process_ip(ip, self)
+            except sqlite3.Error:
+                raise
+            except Exception as e:
+                logger.error(f"Processing failed: {ip} - Error: {e}")
+                self.metrics.errors += 1
+                continue
+            if chunk is not None:
+                await self.checkpoint.host_done(chunk)
+
+    async def run(self, addresses, checkpoint=None):
+        """
+        Processes every address produced by the given iterable. The iterable is
+        consumed lazily, only as fast as the workers free up.
+
+        Args:
+            addresses (iterable): IP addresses to scan. Must be indexable, like a
+                TargetSet, when a checkpoint is given.
+            checkpoint (ScanCheckpoint): Optional progress tracker of a resumable run.
+        """
+        self.checkpoint = checkpoint
+        queue = asyncio.Queue(maxsize=self.workers * 2)
+        workers = [asyncio.create_task(self._worker(queue)) for _ in range(self.workers)]
         try:
-            async with asyncssh.connect(ip, username=username, password=password) as conn:
-                logger.info(f"SSH connection successful: {ip}")
-                return True
-        except (asyncssh.Error, OSError) as e:
-            logger.warning(
-                f"SSH connection failed: {ip} - Attempt {attempt + 1}/{retries}")
-            attempt += 1
-            await asyncio.sleep(1)
-    return False
+            if checkpoint is None:
+                for ip in addresses:
+                    await queue.put((str(ip), None))
+            else:
+                async for item in checkpoint.pending(addresses):
+                    await queue.put(item)
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        finally:
+            for worker in workers:
+                worker.cancel()
+
+
+async def check_liveness(ip, scanner):
+    """
+    Races an ICMP echo against TCP connects to the scanner's liveness ports. The
+    TCP probes only start after a short head start, so hosts answering the ping
+    cost a single packet, and wait no longer than the ping for the subnet's RTT.
+    The first positive answer wins and cancels the rest; a refused connection
+    counts as positive, since only a live host sends it.
+
+    Args:
+        ip (str): The IP address to check.
+        scanner (Scanner): The scanner providing the ports, timeouts and rate limits.
+
+    Returns:
+        tuple: (is_active, rtt, ports) where rtt is the ping round-trip time or None,
+        and ports maps each TCP port probed to the result of tcp_connect_state.
+    """
+    timeout = scanner.rtt.timeout(ip)
+
+    async def icmp():
+        await scanner.limiter.packet()
+        with scanner.metrics.phase('ping'):
+            return None, await ping_rtt(ip, timeout)
+
+    async def tcp(port):
+        await asyncio.sleep(scanner.liveness_stagger)
+        async with scanner.probe_limit:
+            await scanner.limiter.connection()
+            with scanner.metrics.phase('tcp_probe'):
+                # A connect is answered within about one RTT as well
+                return port, await tcp_connect_state(ip, port, min(scanner.probe_timeout, timeout))
+
+    tasks = [asyncio.create_task(icmp())] + [asyncio.create_task(tcp(port)) for port in scanner.liveness_ports]
+    ports = {}
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            port, result = await next_done
+            if port is None:
+                if result is not None:
+                    return True, result, ports
+            else:
+                ports[port] = result
+                if result is not None:
+                    return True, None, ports
+        return False, None, ports
+    finally:
+        for task in tasks:
+            task.cancel()
 
 
-async def process_ip(ip):
+async def process_ip(ip, scanner):
     """
-    Processes a given IP address: checks if it is active via ping, and attempts
-    to establish an SSH connection if it's active.
+    Processes a given IP address: checks if it is active via the neighbor table or
+    the ping and TCP liveness race, probes TCP port 22 if it's active (unless the
+    race already did), and attempts to establish an SSH connection only if the
+    port is open.
+
+    In banner mode the port probe and login are replaced by reading the server's
+    identification string. Verify mode reads the banner and the host key, and only
+    logs in if either differs from the host key cache. Login mode keeps the banner
+    the server sent during the login.
 
     Args:
         ip (str): The IP address to process.
+        scanner (Scanner): The scanner providing the concurrency limits and result writer.
+    """
+    ports = {}
+    if ip in scanner.neighbors:
+        is_active = True
+    else:
+        async with scanner.ping_limit:
+            is_active, rtt, ports = await check_liveness(ip, scanner)
+        if rtt is not None:
+            scanner.rtt.observe(ip, rtt)
+
+    if not is_active:
+        logger.debug(f"IP is not active: {ip}")
+        await scanner.writer.submit(ip, 0, 0, 0)
+        return
+
+    logger.debug(f"IP is active: {ip}")
+    is_port_open, banner = ports.get(22), None
+    if scanner.ssh_mode == "login":
+        if is_port_open is None:
+            async with scanner.probe_limit:
+                await scanner.limiter.connection()
+                with scanner.metrics.phase('tcp_probe'):
+                    is_port_open = await probe_tcp_port(ip, 22, scanner.probe_timeout)
+    elif is_port_open is not False:
+        async with scanner.probe_limit:
+            await scanner.limiter.connection()
+            with scanner.metrics.phase('tcp_probe'):
+                is_port_open, banner = await grab_ssh_banner(ip, 22, scanner.probe_timeout * 2)
+        if banner:
+            logger.debug(f"SSH banner: {ip} - {banner}")
+
+    if not is_port_open:
+        logger.debug(f"SSH port closed: {ip}")
+        await scanner.writer.submit(ip, 1, None if scanner.ssh_mode == "banner" else 0, 0, banner)
+        return
+    if scanner.ssh_mode == "banner":
+        await scanner.writer.submit(ip, 1, None, 1, banner)
+        return
+
+    host_key = None
+    if scanner.ssh_mode == "verify":
+        async with scanner.ssh_limit:
+            await scanner.limiter.connection()
+            with scanner.metrics.phase('ssh'):
+                host_key = await fetch_host_key(ip, metrics=scanner.metrics)
+        if host_key is not None:
+            cached = scanner.host_keys.get(ip, host_key[0])
+            changed = await scanner.host_keys.record(ip, *host_key, banner)
+            if cached is not None and not changed and cached[1] == banner:
+                logger.debug(f"SSH host unchanged: {ip}")
+                await scanner.writer.submit(ip, 1, None, 1, banner)
+                return
+
+    async with scanner.ssh_limit:
+        with scanner.metrics.phase('ssh'):
+            is_ssh_connected, login_key, login_banner = await ssh_login(
+                ip, limiter=scanner.limiter, policy=scanner.ssh_retry, metrics=scanner.metrics)
+    banner = banner or login_banner
+    if login_key is not None and scanner.host_keys is not None and login_key != host_key:
+        await scanner.host_keys.record(ip, *login_key, banner)
+    await scanner.writer.submit(ip, 1, 1 if is_ssh_connected else 0, 1, banner)
+
+
+async def main(targets="172.29.0.0/16", workers=512, ping_concurrency=512, ssh_concurrency=64,
+               probe_concurrency=512, probe_timeout=1.0, resume=False, ttl=None, chunk_size=256,
+               shard=0, shards=1, ping_timeout_floor=0.05, ping_timeout_ceiling=1.0,
+               max_pps=None, max_cps=None, burst=0.2, order="sequential", seed=0, neighbors=False,
+               prime_neighbors=False, compact_interval=300.0, exclude=(), liveness_ports=(22, 443, 80),
+               liveness_stagger=0.1, ssh_mode="login", ssh_retries=3, ssh_deadline=15.0, ssh_backoff=0.25,
+               hitlist=(), progress_interval=10.0, metrics_port=None, metrics_host="127.0.0.1"):
     """
-    is_active = await ping_ip(ip)
+    Main function that streams all IP addresses in the given targets through a
+    bounded pool of workers (ping check and SSH connection), recording progress
+    so an interrupted scan can be resumed.
 
-    if is_active:
-        logger.info(f"IP is active: {ip}")
-        save_ip(ip, 1, 0)
-        is_ssh_connected = await ssh_connect(ip)
-        save_ip(ip, 1, 1 if is_ssh_connected else 0)
+    Args:
+        targets (str or list): Target specifications to scan, see parse_target_spec.
+        workers (int): Number of hosts processed concurrently.
+        ping_concurrency (int): Maximum number of pings in flight.
+        ssh_concurrency (int): Maximum number of SSH connection attempts in flight.
+        probe_concurrency (int): Maximum number of port 22 probes in flight.
+        probe_timeout (float): Seconds to wait for port 22 to accept a connection.
+        resume (bool): Continue the last unfinished run of the same network.
+        ttl (float): If set, only probe hosts last observed more than this many seconds ago.
+        chunk_size (int): Number of consecutive hosts tracked as one unit of progress.
+        shard (int): Index of the contiguous sub-range to scan when the network is sharded.
+        shards (int): Number of sub-ranges the network is split into.
+        ping_timeout_floor (float): Minimum RTT-derived ping timeout in seconds.
+        ping_timeout_ceiling (float): Maximum ping timeout in seconds.
+        max_pps (float): Maximum ICMP echo requests per second, unlimited if None.
+        max_cps (float): Maximum new TCP connections per second, unlimited if None.
+        burst (float): Seconds worth of packets or connections that may be sent at once.
+        order (str): "sequential" or "random" scan order.
+        seed (int): Seed of the random scan order.
+        neighbors (bool): Mark hosts the kernel neighbor table lists as REACHABLE active without pinging them.
+        prime_neighbors (bool): Prime the neighbor cache for local hosts before reading it.
+        compact_interval (float): Seconds between background history compactions.
+        exclude (list): Target specifications of addresses never to probe.
+        liveness_ports (tuple): TCP ports raced against the ping to detect hosts that drop ICMP.
+        liveness_stagger (float): Head start in seconds given to the ping before the TCP probes.
+        ssh_mode (str): "login" to authenticate over SSH, "banner" to only read the server's
+            identification string, "verify" to log in only to hosts whose banner or host key
+            changed since the last sweep.
+        ssh_retries (int): Maximum SSH login attempts per host.
+        ssh_deadline (float): Seconds after the first SSH attempt by which a host is given up.
+        ssh_backoff (float): Upper bound in seconds of the first jittered backoff between SSH attempts.
+        hitlist (list): IPv6 hit-list sources scanned instead of the targets, see hitlist_candidates.
+        progress_interval (float): Seconds between progress summaries in the log.
+        metrics_port (int): If set, serve Prometheus metrics on this port, plus the shard index.
+        metrics_host (str): Address the metrics endpoint listens on.
+    """
+    if hitlist:
+        if ssh_mode == "verify":
+            raise ValueError("Verify mode is not available for IPv6 hit lists, use login or banner mode")
+        hosts = HitList.load(hitlist, exclude)
     else:
-        logger.info(f"IP is not active: {ip}")
-        save_ip(ip, 0, 0)
+        hosts = TargetSet.parse(targets, exclude)
+    target = str(hosts)
+    if shards > 1:
+        hosts = hosts.shard(shard, shards)
+        target = f"{target}#{shard}/{shards}"
+    if order == "random":
+        hosts = PermutedHosts(hosts, seed)
+        target = f"{target}@random:{seed}"
+    metrics = ScanMetrics(len(hosts))
+    writer = ResultWriter(metrics=metrics)
+    await writer.start()
+    rtt = RTTEstimator(ping_timeout_floor, ping_timeout_ceiling)
+    limiter = RateLimiter(max_pps, max_cps, burst)
+    known = None
+    if neighbors and hitlist:
+        known = {ip for ip, state in read_ipv6_neighbors().items() if state == 'REACHABLE'}
+    elif neighbors:
+        known = await discover_neighbors(hosts, prime_neighbors, limiter=limiter)
+    host_keys = None
+    if ssh_mode != "banner" and not hitlist:
+        host_keys = HostKeyCache(writer)
+        host_keys.load()
+    ssh_retry = RetryPolicy(ssh_retries, ssh_backoff, deadline=ssh_deadline)
+    scanner = Scanner(writer, workers, ping_concurrency, ssh_concurrency, probe_concurrency, probe_timeout, rtt,
+                      limiter, known, liveness_ports, liveness_stagger, ssh_mode, host_keys, ssh_retry, metrics)
+    checkpoint = ScanCheckpoint(writer, target, chunk_size, resume, ttl)
+    checkpoint.open()
+    exporter = await serve_metrics(metrics, metrics_host, metrics_port + shard) if metrics_port else None
+    reporter = asyncio.create_task(report_progress(metrics, limiter, progress_interval))
+    compactor = asyncio.create_task(compact_periodically(DB_PATH, compact_interval))
+
+    try:
+        await scanner.run(hosts, checkpoint)
+        if checkpoint.incomplete_chunks() or metrics.errors:
+            logger.warning(f"{metrics.errors} hosts failed in {checkpoint.incomplete_chunks()} chunks, leaving "
+                           f"scan run {checkpoint.run_id} unfinished so --resume probes them again")
+            checkpoint.close()
+        else:
+            await checkpoint.finish()
+    finally:
+        reporter.cancel()
+        compactor.cancel()
+        close_icmp_engine()
+        try:
+            await writer.close()
+        finally:
+            logger.info(f"Finished: {metrics.summary()}")
+            if exporter is not None:
+                await exporter.cleanup()
+    await asyncio.to_thread(compact_history, DB_PATH)
+
+
+def run_shard(targets, shard, shards, options):
+    """
+    Entry point of a worker process: scans one shard of the targets in its own event loop.
+
+    Args:
+        targets (list): Target specifications to scan.
+        shard (int): Index of the shard handled by this process.
+        shards (int): Total number of shards.
+        options (dict): Keyword arguments passed on to main().
+    """
+    asyncio.run(main(targets, shard=shard, shards=shards, **options))
+
 
+def snapshot_hitlist(sources, exclude=()):
+    """
+    Builds a hit list once and writes it to a temporary file, so every shard of a
+    sharded scan slices the same list. Sources like the neighbor cache and the
+    addresses of earlier scans change over time, the latter even while sibling
+    shards write their results.
+
+    Args:
+        sources (list): The hit-list sources, see hitlist_candidates.
+        exclude (list): IPv6 networks or addresses to leave out.
+
+    Returns:
+        str: Path of the file, one address per line in hit-list order; the caller deletes it.
+    """
+    hitlist = HitList.load(sources, exclude)
+    with tempfile.NamedTemporaryFile('w', prefix='q1-hitlist-', suffix='.txt', delete=False) as f:
+        for ip in hitlist:
+            f.write(f"{ip}\n")
+    return f.name
+
+
+def run_sharded(targets, processes, **options):
+    """
+    Splits the targets into contiguous sub-ranges and scans each one in a separate
+    process, so SSH handshakes and result handling use every CPU core. All processes
+    write into the shared database. Concurrency limits apply per process, while the
+    packet and connection rate limits are split evenly, so together the processes
+    stay within the global budget. A hit list is built once, before the processes
+    start, and handed to them as a file.
 
-async def main():
+    Args:
+        targets (list): Target specifications to scan.
+        processes (int): Number of worker processes (and shards).
+        **options: Keyword arguments passed on to main() in every process.
     """
-    Main function that iterates over all IP addresses in the 172.29.0.0/16 network
-    and processes them asynchronously (ping check and SSH connection).
+    for name in ('max_pps', 'max_cps'):
+        if options.get(name):
+            options[name] = options[name] / processes
+    snapshot = None
+    if options.get('hitlist'):
+        snapshot = snapshot_hitlist(options['hitlist'], options.get('exclude'))
+        options['hitlist'] = ['@' + snapshot]
+    try:
+        with concurrent.futures.ProcessPoolExecutor(processes) as pool:
+            futures = [pool.submit(run_shard, targets, shard, processes, options) for shard in range(processes)]
+            for future in concurrent.futures.as_completed(futures):
+                future.result()
+    finally:
+        if snapshot is not None:
+            os.remove(snapshot)
+
+
+def parse_args():
     """
-    network = ipaddress.IPv4Network("172.29.0.0/16")
-    tasks = []
+    Parses the command line options of the scanner.
 
-    for ip in network.hosts():
-        tasks.append(process_ip(str(ip)))
+    Returns:
+        argparse.Namespace: The parsed options.
+    """
+    parser = argparse.ArgumentParser(description="Scan a network for active hosts and SSH access.")
+    parser.add_argument("targets", nargs="*", default=["172.29.0.0/16"],
+                        help="Networks, address ranges (a.b.c.d-e.f.g.h), addresses or @files to scan.")
+    parser.add_argument("--exclude", action="append", default=[], metavar="SPEC",
+                        help="Networks, address ranges, addresses or @files never to probe.")
+    parser.add_argument("--workers", type=int, default=512, help="Hosts processed concurrently.")
+    parser.add_argument("--ping-concurrency", type=int, default=512, help="Maximum pings in flight.")
+    parser.add_argument("--ssh-concurrency", type=int, default=64, help="Maximum SSH attempts in flight.")
+    parser.add_argument("--probe-concurrency", type=int, default=512, help="Maximum port 22 probes in flight.")
+    parser.add_argument("--probe-timeout", type=float, default=1.0, help="Port 22 connect timeout in seconds.")
+    parser.add_argument("--resume", action="store_true", help="Continue the last unfinished scan of the network.")
+    parser.add_argument("--ttl", type=float, help="Only probe hosts last observed more than this many seconds ago.")
+    parser.add_argument("--chunk-size", type=int, default=256, help="Hosts per unit of recorded progress.")
+    parser.add_argument("--ping-timeout-floor", type=float, default=0.05, help="Minimum ping timeout in seconds.")
+    parser.add_argument("--ping-timeout-ceiling", type=float, default=1.0, help="Maximum ping timeout in seconds.")
+    parser.add_argument("--max-pps", type=float, help="Maximum ICMP echo requests per second.")
+    parser.add_argument("--max-cps", type=float, help="Maximum new TCP connections per second.")
+    parser.add_argument("--burst", type=float, default=0.2, help="Seconds worth of packets allowed in one burst.")
+    parser.add_argument("--order", choices=["sequential", "random"], default="sequential",
+                        help="Visit the network in address order or in a seeded pseudo-random permutation.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the random scan order.")
+    parser.add_argument("--neighbors", action="store_true",
+                        help="Treat hosts the kernel neighbor table lists as REACHABLE as active without "
+                             "pinging them.")
+    parser.add_argument("--prime-neighbors", action="store_true",
+                        help="Prime the neighbor cache for directly attached hosts before reading it.")
+    parser.add_argument("--compact-interval", type=float, default=300.0,
+                        help="Seconds between background compactions of the observation log.")
+    parser.add_argument("--compact", action="store_true", help="Compact the observation log into history and exit.")
+    parser.add_argument("--export", metavar="FILE", help="Export the stored results to FILE and exit.")
+    parser.add_argument("--export-format", choices=["csv", "jsonl", "parquet"],
+                        help="Export format, derived from the file extension by default.")
+    parser.add_argument("--export-subnet", help="Only export addresses in this CIDR range.")
+    parser.add_argument("--export-state", choices=sorted(EXPORT_STATES), help="Only export hosts in this state.")
+    parser.add_argument("--liveness-ports", type=lambda value: tuple(int(p) for p in value.split(',') if p),
+                        default=(22, 443, 80),
+                        help="Comma-separated TCP ports raced against the ping, empty to ping only.")
+    parser.add_argument("--liveness-stagger", type=float, default=0.1,
+                        help="Seconds the ping runs alone before the TCP liveness probes start.")
+    parser.add_argument("--ssh-mode", choices=["login", "banner", "verify"], default="login",
+                        help="Log in over SSH, only read the server identification banner, or log in only "
+                             "to hosts whose banner or host key changed since the last sweep.")
+    parser.add_argument("--ssh-retries", type=int, default=3,
+                        help="Maximum SSH login attempts per host; only transient errors are retried.")
+    parser.add_argument("--ssh-deadline", type=float, default=15.0,
+                        help="Seconds after the first SSH attempt by which a host is given up.")
+    parser.add_argument("--ssh-backoff", type=float, default=0.25,
+                        help="Upper bound in seconds of the first jittered backoff, doubled per attempt.")
+    parser.add_argument("--hitlist", action="append", default=[], metavar="SOURCE",
+                        help="Scan IPv6 candidates instead of the targets: @file (address list, DHCPv6 log or "
+                             "leases), 'neighbors', 'previous', an address or a small network. Repeatable.")
+    parser.add_argument("--progress-interval", type=float, default=10.0,
+                        help="Seconds between one-line progress summaries in the log.")
+    parser.add_argument("--metrics-port", type=int, default=None,
+                        help="Serve Prometheus metrics at /metrics on this port; shard N uses port + N.")
+    parser.add_argument("--metrics-host", default="127.0.0.1", help="Address the metrics endpoint listens on.")
+    parser.add_argument("--processes", type=int, default=1, help="Worker processes, one shard of the network each.")
+    return parser.parse_args()
 
-    await asyncio.gather(*tasks)
 
 if __name__ == "__main__":
+    args = parse_args()
     create_db()
-    asyncio.run(main())
+    options = dict(workers=args.workers, ping_concurrency=args.ping_concurrency, ssh_concurrency=args.ssh_concurrency,
+                   probe_concurrency=args.probe_concurrency, probe_timeout=args.probe_timeout, resume=args.resume,
+                   ttl=args.ttl, chunk_size=args.chunk_size, ping_timeout_floor=args.ping_timeout_floor,
+                   ping_timeout_ceiling=args.ping_timeout_ceiling, max_pps=args.max_pps, max_cps=args.max_cps,
+                   burst=args.burst, order=args.order, seed=args.seed, neighbors=args.neighbors,
+                   prime_neighbors=args.prime_neighbors, compact_interval=args.compact_interval,
+                   exclude=args.exclude, liveness_ports=args.liveness_ports,
+                   liveness_stagger=args.liveness_stagger, ssh_mode=args.ssh_mode,
+                   ssh_retries=args.ssh_retries, ssh_deadline=args.ssh_deadline, ssh_backoff=args.ssh_backoff,
+                   hitlist=args.hitlist, progress_interval=args.progress_interval,
+                   metrics_port=args.metrics_port, metrics_host=args.metrics_host)
+    if args.export:
+        count = export_results(args.export, args.export_format, args.export_subnet, args.export_state)
+        logger.info(f"Exported {count} results to {args.export}")
+    elif args.compact:
+        logger.info(f"Compacted {compact_history()} observations into history")
+    elif args.processes > 1:
+        run_sharded(args.targets, args.processes, **options)
+    else:
+        asyncio.run(main(args.targets, **options))
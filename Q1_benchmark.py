@@ -0,0 +1,357 @@
+import argparse
+import asyncio
+import ctypes
+import ipaddress
+import json
+import logging
+import multiprocessing
+import os
+import random
+import resource
+import socket
+import struct
+import subprocess
+import tempfile
+import time
+
+import asyncssh
+
+import Q1
+import icmp_echo
+
+BENCHMARK_PASSWORD = 'password'
+ICMP_ECHO_IGNORE_ALL = '/proc/sys/net/ipv4/icmp_echo_ignore_all'
+# Not exported by the os module before Python 3.12
+CLONE_NEWNET = 0x40000000
+
+
+class BenchmarkSSHServer(asyncssh.SSHServer):
+    """
+    Stand-in SSH server that accepts the password Q1 logs in with.
+    """
+
+    def begin_auth(self, username):
+        return True
+
+    def password_auth_supported(self):
+        return True
+
+    def validate_password(self, username, password):
+        return password == BENCHMARK_PASSWORD
+
+
+async def serve_ssh(addresses, host_key, ready, stop):
+    """
+    Runs one SSH server on port 22 of each given loopback address until told to stop.
+
+    Args:
+        addresses (list): The 127.0.0.0/8 addresses to listen on.
+        host_key (bytes): The servers' private host key in OpenSSH format.
+        ready (multiprocessing.Event): Set once every server is listening.
+        stop (multiprocessing.Event): Set by the benchmark when the servers can shut down.
+    """
+    key = asyncssh.import_private_key(host_key)
+    servers = [await asyncssh.create_server(BenchmarkSSHServer, ip, 22, server_host_keys=[key])
+               for ip in addresses]
+    ready.set()
+    await asyncio.to_thread(stop.wait)
+    for server in servers:
+        server.close()
+        await server.wait_closed()
+
+
+def run_ssh_servers(addresses, host_key, ready, stop):
+    """
+    Entry point of the server process, so the servers do not share the scanner's
+    event loop, memory or file descriptors.
+    """
+    asyncio.run(serve_ssh(addresses, host_key, ready, stop))
+
+
+def trust_host_key(key, home):
+    """
+    Makes the given key trusted for every benchmark address, by pointing HOME at a
+    directory whose ~/.ssh/known_hosts lists it. The user's own known_hosts file
+    is left alone.
+
+    Args:
+        key (asyncssh.SSHKey): The servers' host key.
+        home (str): The directory used as HOME.
+    """
+    os.makedirs(os.path.join(home, '.ssh'), exist_ok=True)
+    with open(os.path.join(home, '.ssh', 'known_hosts'), 'wb') as f:
+        f.write(b'127.77.*.* ' + key.export_public_key('openssh'))
+    os.environ['HOME'] = home
+
+
+async def answer_pings(alive, latency, jitter, loss, seed, ready, stop):
+    """
+    Answers the echo requests sent to the live benchmark addresses on loopback:
+    each reply is sent from the pinged address after a random latency, a share of
+    the echoes is lost, and everyone else stays silent. Q1's ICMP engine pings
+    these addresses for real and reads the replies from its own socket.
+
+    Args:
+        alive (set): The addresses that answer pings.
+        latency (float): Mean round-trip time in seconds.
+        jitter (float): Standard deviation of the round-trip time in seconds.
+        loss (float): Probability that an echo or its reply is lost.
+        seed (int): Seed of the latency and loss draws.
+        ready (multiprocessing.Event): Set once the responder is listening.
+        stop (multiprocessing.Event): Set by the benchmark when the responder can shut down.
+    """
+    loop = asyncio.get_running_loop()
+    rng = random.Random(seed)
+    listener = socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_ICMP)
+    listener.setblocking(False)
+    # IPPROTO_RAW sockets take the IP header from us, so replies can come from the pinged address
+    sender = socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_RAW)
+    sender.setblocking(False)
+
+    def on_readable():
+        while True:
+            try:
+                packet = listener.recv(2048)
+            except (BlockingIOError, InterruptedError):
+                return
+            icmp = packet[(packet[0] & 0x0f) * 4:]
+            source, target = packet[12:16], packet[16:20]
+            if len(icmp) < 8 or icmp[0] != icmp_echo.ICMP_ECHO_REQUEST:
+                continue
+            if socket.inet_ntoa(target) not in alive or rng.random() < loss:
+                continue
+            reply = struct.pack('!BBH', icmp_echo.ICMP_ECHO_REPLY, 0, 0) + icmp[4:]
+            reply = reply[:2] + struct.pack('!H', icmp_echo.icmp_checksum(reply)) + reply[4:]
+            # The kernel fills in the header checksum, the total length and the identification
+            header = struct.pack('!BBHHHBBH4s4s', 0x45, 0, 0, 0, 0, 64, socket.IPPROTO_ICMP, 0, target, source)
+            loop.call_later(max(0.0, rng.gauss(latency, jitter)), send, header + reply, socket.inet_ntoa(source))
+
+    def send(packet, destination):
+        try:
+            sender.sendto(packet, (destination, 0))
+        except OSError:
+            pass
+
+    loop.add_reader(listener.fileno(), on_readable)
+    ready.set()
+    try:
+        await asyncio.to_thread(stop.wait)
+    finally:
+        loop.remove_reader(listener.fileno())
+        listener.close()
+        sender.close()
+
+
+def run_icmp_responder(alive, latency, jitter, loss, seed, ready, stop):
+    """
+    Entry point of the responder process, so replies are timed independently of the scanner's event loop.
+    """
+    asyncio.run(answer_pings(alive, latency, jitter, loss, seed, ready, stop))
+
+
+def enter_private_network(path=ICMP_ECHO_IGNORE_ALL):
+    """
+    Moves this process into a new network namespace with only loopback up, and
+    stops the kernel from answering pings there, since it would otherwise answer
+    for every address in 127.0.0.0/8 before the responder does. Processes started
+    afterwards inherit the namespace, and it disappears with the last of them, so
+    nothing outside the benchmark is affected even if it is killed.
+
+    Args:
+        path (str): Path of the icmp_echo_ignore_all setting in procfs.
+    """
+    try:
+        if hasattr(os, 'unshare'):
+            os.unshare(os.CLONE_NEWNET)
+        elif ctypes.CDLL(None, use_errno=True).unshare(CLONE_NEWNET) != 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+        subprocess.run(['ip', 'link', 'set', 'lo', 'up'], check=True, stderr=subprocess.PIPE)
+        with open(path, 'w') as f:
+            f.write('1')
+    except (OSError, subprocess.CalledProcessError) as e:
+        raise RuntimeError(f"Cannot set up a private network namespace, this needs root: {e}")
+
+
+class ResourceSampler:
+    """
+    Tracks the peak number of open file descriptors of this process.
+    """
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.peak_fds = 0
+
+    def sample(self):
+        self.peak_fds = max(self.peak_fds, len(os.listdir('/proc/self/fd')))
+
+    async def run(self):
+        while True:
+            self.sample()
+            await asyncio.sleep(self.interval)
+
+
+def percentile(values, fraction):
+    """
+    Returns the nearest-rank percentile of the given values.
+
+    Args:
+        values (list): The sorted samples.
+        fraction (float): The percentile as a fraction, e.g. 0.99.
+
+    Returns:
+        float: The sample at that rank, or None if there are no samples.
+    """
+    if not values:
+        return None
+    return values[min(len(values) - 1, max(0, round(fraction * len(values)) - 1))]
+
+
+async def run_benchmark(hosts=1024, alive=0.25, ssh_hosts=32, latency=0.005, jitter=0.002, loss=0.0, seed=0,
+                        **options):
+    """
+    Scans a simulated network of loopback addresses with Q1.main and measures it.
+    Runs in a scratch working directory, which receives Q1's database and the
+    known_hosts file, and in the network namespace set up by enter_private_network().
+
+    Pings go through Q1's own ICMP engine and are answered by answer_pings(). The
+    first `ssh_hosts` live hosts run a real SSH server; the other live hosts
+    refuse connections to port 22, as loopback does for every address nobody
+    listens on. For the same reason the TCP liveness probes would find every
+    address alive, so they stay off unless `liveness_ports` is passed on.
+
+    Args:
+        hosts (int): Number of addresses scanned, starting at 127.77.0.1.
+        alive (float): Share of the addresses that answer pings.
+        ssh_hosts (int): Number of live hosts running an SSH server.
+        latency (float): Mean ping round-trip time of the responder in seconds.
+        jitter (float): Standard deviation of the simulated round-trip time.
+        loss (float): Probability that a ping is lost.
+        seed (int): Seed choosing the live hosts and the ping draws.
+        **options: Keyword arguments passed on to Q1.main().
+
+    Returns:
+        dict: The measurements.
+    """
+    first = ipaddress.IPv4Address('127.77.0.1')
+    addresses = [str(first + i) for i in range(hosts)]
+    rng = random.Random(seed)
+    live = rng.sample(addresses, round(hosts * alive))
+    ssh_addresses = live[:ssh_hosts]
+
+    key = asyncssh.generate_private_key('ssh-ed25519')
+    trust_host_key(key, os.getcwd())
+    context = multiprocessing.get_context('spawn')
+    ready, icmp_ready, stop = context.Event(), context.Event(), context.Event()
+    servers = context.Process(target=run_ssh_servers, daemon=True,
+                              args=(ssh_addresses, key.export_private_key(), ready, stop))
+    responder = context.Process(target=run_icmp_responder, daemon=True,
+                                args=(set(live), latency, jitter, loss, seed, icmp_ready, stop))
+    servers.start()
+    responder.start()
+    try:
+        if not await asyncio.to_thread(ready.wait, 60):
+            raise RuntimeError("SSH servers did not start, binding port 22 needs root or CAP_NET_BIND_SERVICE")
+        if not await asyncio.to_thread(icmp_ready.wait, 60):
+            raise RuntimeError("ICMP responder did not start, raw sockets need root or CAP_NET_RAW")
+    except BaseException:
+        stop.set()
+        raise
+
+    options.setdefault('liveness_ports', ())
+    durations = []
+    process_ip = Q1.process_ip
+
+    async def timed_process_ip(ip, scanner):
+        started = time.perf_counter()
+        try:
+            await process_ip(ip, scanner)
+        finally:
+            durations.append(time.perf_counter() - started)
+
+    Q1.process_ip = timed_process_ip
+    sampler = ResourceSampler()
+    sampling = asyncio.create_task(sampler.run())
+    started = time.perf_counter()
+    try:
+        await Q1.main([f"{addresses[0]}-{addresses[-1]}"], **options)
+    finally:
+        elapsed = time.perf_counter() - started
+        sampling.cancel()
+        sampler.sample()
+        Q1.process_ip = process_ip
+        stop.set()
+        servers.join(10)
+        responder.join(10)
+
+    durations.sort()
+    rows = list(Q1.query_range())
+    found_active = sum(row[1] == 1 for row in rows)
+    connected = sum(row[2] == 1 for row in rows)
+    return {
+        'hosts': hosts,
+        'alive': len(live),
+        'ssh_hosts': len(ssh_addresses),
+        'found_active': found_active,
+        'ssh_connected': connected,
+        'liveness_ports': ','.join(map(str, options['liveness_ports'])) or 'none',
+        'seconds': round(elapsed, 3),
+        'hosts_per_second': round(hosts / elapsed, 1),
+        'p50_ms': round(percentile(durations, 0.50) * 1000, 2),
+        'p99_ms': round(percentile(durations, 0.99) * 1000, 2),
+        # ru_maxrss is reported in kilobytes on Linux
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'peak_fds': sampler.peak_fds,
+    }
+
+
+def parse_args():
+    """
+    Parses the command line options of the benchmark.
+
+    Returns:
+        argparse.Namespace: The parsed options.
+    """
+    parser = argparse.ArgumentParser(
+        description="Benchmark Q1 against local stand-in SSH servers and ICMP responder.")
+    parser.add_argument("--hosts", type=int, default=1024, help="Number of loopback addresses scanned.")
+    parser.add_argument("--alive", type=float, default=0.25, help="Share of the addresses answering pings.")
+    parser.add_argument("--ssh-hosts", type=int, default=32, help="Number of live hosts running an SSH server.")
+    parser.add_argument("--latency", type=float, default=0.005, help="Mean ping RTT of the responder in seconds.")
+    parser.add_argument("--jitter", type=float, default=0.002, help="Standard deviation of the ping RTT.")
+    parser.add_argument("--loss", type=float, default=0.0, help="Probability that a ping is lost.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the simulated network.")
+    parser.add_argument("--workers", type=int, default=512, help="Number of hosts processed concurrently.")
+    parser.add_argument("--ssh-mode", choices=["login", "banner"], default="login",
+                        help="Q1 SSH mode benchmarked.")
+    parser.add_argument("--ping-timeout-ceiling", type=float, default=0.2,
+                        help="Maximum ping timeout in seconds, i.e. the cost of a silent host.")
+    parser.add_argument("--json", action="store_true", help="Print the measurements as one JSON object.")
+    parser.add_argument("--verbose", action="store_true", help="Keep Q1's per-host log lines.")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if not args.verbose:
+        logging.getLogger(Q1.__name__).setLevel(logging.WARNING)
+    enter_private_network()
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix='q1-benchmark-') as scratch:
+        # Q1 keeps its database in the working directory
+        os.chdir(scratch)
+        try:
+            Q1.create_db()
+            results = asyncio.run(run_benchmark(
+                args.hosts, args.alive, args.ssh_hosts, args.latency, args.jitter, args.loss, args.seed,
+                workers=args.workers, ssh_mode=args.ssh_mode, ping_timeout_ceiling=args.ping_timeout_ceiling,
+                liveness_ports=(), compact_interval=3600.0))
+        finally:
+            os.chdir(cwd)
+    if args.json:
+        print(json.dumps(results))
+    else:
+        for name, value in results.items():
+            print(f"{name:>16}: {value}")
+        print("TCP liveness probes are off, since loopback refuses every port and they would find every "
+              "address alive; Q1 races ports 22, 443 and 80 against the ping by default.")
@@ -0,0 +1,549 @@
+import asyncio
+import csv
+import errno
+import json
+import os
+import sqlite3
+import time
+
+import asyncssh
+
+import Q1
+
+
+def test_merge_intervals():
+    assert Q1.merge_intervals([(10, 20), (1, 5), (6, 8), (15, 30), (40, 40)]) == [(1, 8), (10, 30), (40, 40)]
+    assert Q1.merge_intervals([]) == []
+
+
+def test_subtract_intervals():
+    intervals = [(1, 10), (20, 30), (40, 50)]
+    assert Q1.subtract_intervals(intervals, []) == intervals
+    assert Q1.subtract_intervals(intervals, [(0, 100)]) == []
+    assert Q1.subtract_intervals(intervals, [(5, 5), (8, 22), (29, 41), (50, 60)]) == [
+        (1, 4), (6, 7), (23, 28), (42, 49)]
+    assert Q1.subtract_intervals([(1, 10)], [(1, 1), (10, 10)]) == [(2, 9)]
+
+
+def test_target_set_parse():
+    hosts = Q1.TargetSet.parse(["10.0.0.0/29", "10.0.0.4-10.0.0.12"], exclude=["10.0.0.5", "10.0.0.8/30"])
+    expected = ["10.0.0.1", "10.0.0.2", "10.0.0.3", "10.0.0.4", "10.0.0.6", "10.0.0.7", "10.0.0.12"]
+    assert list(hosts) == expected
+    assert len(hosts) == len(expected)
+    assert [hosts[i] for i in range(len(hosts))] == expected
+
+
+def test_target_set_from_a_file_is_named_by_its_addresses(tmp_path):
+    targets = tmp_path / "targets.txt"
+    targets.write_text("10.0.0.0/30\n")
+    before = Q1.TargetSet.parse(f"@{targets}")
+    targets.write_text("10.0.0.0/30  # lab\n10.0.1.1\n")
+    after = Q1.TargetSet.parse(f"@{targets}")
+    assert str(before) == "10.0.0.1-10.0.0.2"
+    assert str(after) == "10.0.0.1-10.0.0.2,10.0.1.1-10.0.1.1"
+    assert str(Q1.TargetSet.parse("10.0.0.0/30")) == "10.0.0.0/30"
+
+def test_target_set_getitem_out_of_range():
+    hosts = Q1.TargetSet.parse("10.0.0.0/30")
+    for index in (-1, 2):
+        try:
+            hosts[index]
+        except IndexError:
+            continue
+        raise AssertionError(f"index {index} did not raise")
+
+
+def test_target_set_shards_cover_the_set():
+    hosts = Q1.TargetSet.parse(["10.0.0.0/28", "10.1.0.0/29", "10.2.0.7"], exclude=["10.0.0.3-10.0.0.9"])
+    for count in (1, 2, 3, 7, len(hosts), len(hosts) + 3):
+        shards = [hosts.shard(index, count) for index in range(count)]
+        assert [ip for shard in shards for ip in shard] == list(hosts)
+        sizes = [len(shard) for shard in shards]
+        assert max(sizes) - min(sizes) <= 1
+
+
+def test_address_permutation_is_a_bijection():
+    for count in (1, 2, 3, 17, 256, 1000, 4097):
+        for seed in (0, 1, 12345):
+            permutation = Q1.AddressPermutation(count, seed)
+            assert sorted(permutation[i] for i in range(count)) == list(range(count))
+
+
+def test_address_permutation_depends_on_seed():
+    first = [Q1.AddressPermutation(1000, 1)[i] for i in range(1000)]
+    second = [Q1.AddressPermutation(1000, 2)[i] for i in range(1000)]
+    assert first != second
+    assert first == [Q1.AddressPermutation(1000, 1)[i] for i in range(1000)]
+
+
+def test_fold_observations():
+    observations = [(1.0, 1, 1, 1), (2.0, 1, 1, 1), (3.0, 0, 0, 0), (4.0, 1, 1, 1)]
+    assert Q1.fold_observations(None, observations) == [
+        [1.0, 2.0, 1, 1, 1], [3.0, 3.0, 0, 0, 0], [4.0, 4.0, 1, 1, 1]]
+    assert Q1.fold_observations([0.0, 0.5, 1, 1, 1], observations[:2]) == [[0.0, 2.0, 1, 1, 1]]
+
+
+def test_fold_observations_keeps_the_login_result_without_a_new_one():
+    observations = [(1.0, 1, 1, 1), (2.0, 1, None, 1), (3.0, 1, 1, 1), (4.0, 1, None, 0)]
+    assert Q1.fold_observations(None, observations) == [[1.0, 3.0, 1, 1, 1], [4.0, 4.0, 1, None, 0]]
+    assert Q1.fold_observations([0.0, 0.5, 1, 0, 1], [(1.0, 1, None, 1)]) == [[0.0, 1.0, 1, 0, 1]]
+    assert Q1.fold_observations(None, [(1.0, 1, None, 1)]) == [[1.0, 1.0, 1, None, 1]]
+
+
+def save_observations(path, rows):
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.executemany(Q1.SAVE_IP_SQL, [(Q1.ip_to_int(ip), active, connected, port_open, at, None, None, None)
+                                          for ip, at, active, connected, port_open in rows])
+    conn.close()
+
+
+def test_compact_history(tmp_path):
+    path = str(tmp_path / "scan.db")
+    Q1.create_db(path)
+    save_observations(path, [
+        ("10.0.0.1", 1.0, 1, 1, 1), ("10.0.0.1", 2.0, 1, 1, 1), ("10.0.0.1", 3.0, 0, 0, 0),
+        ("10.0.0.2", 1.0, 0, 0, 0), ("10.0.0.2", 5.0, 0, 0, 0)])
+    assert Q1.compact_history(path, before=10.0, batch_size=2) == 5
+    # A later compaction extends the last interval instead of starting a new one
+    save_observations(path, [("10.0.0.1", 4.0, 0, 0, 0), ("10.0.0.1", 6.0, 1, 0, 0)])
+    assert Q1.compact_history(path, before=10.0) == 2
+
+    assert Q1.host_history("10.0.0.1", path) == [(1.0, 2.0, 1, 1, 1), (3.0, 4.0, 0, 0, 0), (6.0, 6.0, 1, 0, 0)]
+    assert Q1.host_history("10.0.0.2", path) == [(1.0, 5.0, 0, 0, 0)]
+    conn = sqlite3.connect(path)
+    assert conn.execute("SELECT COUNT(*) FROM ip_observations").fetchone() == (0,)
+    conn.close()
+    assert Q1.state_changes("10.0.0.0/24", 2.5, 10.0, path) == [
+        ("10.0.0.1", 3.0, 1, 0, 1, 0), ("10.0.0.1", 6.0, 0, 1, 0, 0)]
+
+
+def test_compact_history_across_banner_passes(tmp_path):
+    path = str(tmp_path / "scan.db")
+    Q1.create_db(path)
+    save_observations(path, [("10.0.0.1", 1.0, 1, 1, 1), ("10.0.0.1", 2.0, 1, None, 1)])
+    Q1.compact_history(path, before=10.0)
+    save_observations(path, [("10.0.0.1", 3.0, 1, 1, 1)])
+    Q1.compact_history(path, before=10.0)
+    assert Q1.host_history("10.0.0.1", path) == [(1.0, 3.0, 1, 1, 1)]
+    assert Q1.state_changes("10.0.0.0/24", 0.0, 10.0, path) == [("10.0.0.1", 1.0, None, 1, None, 1)]
+
+
+def test_trigger_keeps_the_latest_observation(tmp_path):
+    path = str(tmp_path / "scan.db")
+    Q1.create_db(path)
+    save_observations(path, [("10.0.0.1", 2.0, 1, 1, 1), ("10.0.0.1", 1.0, 0, 0, 0)])
+    assert list(Q1.query_range("10.0.0.0/24", path=path)) == [("10.0.0.1", 1, 1, 1, 2.0, None, None)]
+    save_observations(path, [("10.0.0.1", 3.0, 0, 0, 0)])
+    assert list(Q1.query_range("10.0.0.0/24", path=path)) == [("10.0.0.1", 0, 0, 0, 3.0, None, None)]
+
+
+def test_trigger_keeps_the_login_result_while_the_port_stays_open(tmp_path):
+    path = str(tmp_path / "scan.db")
+    Q1.create_db(path)
+    save_observations(path, [("10.0.0.1", 1.0, 1, 1, 1), ("10.0.0.1", 2.0, 1, None, 1)])
+    assert list(Q1.query_range(path=path, is_ssh_connected=1)) == [("10.0.0.1", 1, 1, 1, 2.0, None, None)]
+    save_observations(path, [("10.0.0.1", 3.0, 1, None, 0)])
+    assert list(Q1.query_range(path=path)) == [("10.0.0.1", 1, None, 0, 3.0, None, None)]
+
+
+def test_trigger_keeps_the_banner_only_while_the_port_stays_open(tmp_path):
+    path = str(tmp_path / "scan.db")
+    Q1.create_db(path)
+    banner = "SSH-2.0-OpenSSH_9.6p1 Ubuntu-3ubuntu13"
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.executemany(Q1.SAVE_IP_SQL, [
+            (1, 1, None, 1, 1.0, banner, *Q1.parse_ssh_banner(banner)),
+            (1, 1, 0, 1, 2.0, None, None, None)])
+    assert conn.execute("SELECT ssh_banner, ssh_software, ssh_version FROM ip_addresses").fetchall() == [
+        (banner, "OpenSSH", "9.6p1")]
+    with conn:
+        conn.execute(Q1.SAVE_IP_SQL, (1, 1, 0, 0, 3.0, None, None, None))
+    assert conn.execute("SELECT ssh_banner, ssh_software, ssh_version FROM ip_addresses").fetchall() == [
+        (None, None, None)]
+    conn.close()
+
+def test_host_key_cache_compares_keys_of_the_same_type(tmp_path):
+    path = str(tmp_path / "scan.db")
+    Q1.create_db(path)
+
+    async def record_keys():
+        writer = Q1.ResultWriter(path, flush_interval=0.01)
+        await writer.start()
+        cache = Q1.HostKeyCache(writer, path)
+        cache.load()
+        changes = [await cache.record("10.0.0.1", "ssh-ed25519", "SHA256:a", "SSH-2.0-OpenSSH_9.6"),
+                   await cache.record("10.0.0.1", "ecdsa-sha2-nistp256", "SHA256:b"),
+                   await cache.record("10.0.0.1", "ssh-ed25519", "SHA256:a"),
+                   await cache.record("10.0.0.1", "ssh-ed25519", "SHA256:c")]
+        await writer.close()
+        return changes
+
+    assert asyncio.run(record_keys()) == [False, False, False, True]
+    cache = Q1.HostKeyCache(None, path)
+    cache.load()
+    assert cache.get("10.0.0.1", "ssh-ed25519") == ("SHA256:c", "SSH-2.0-OpenSSH_9.6")
+    assert cache.get("10.0.0.1", "ecdsa-sha2-nistp256") == ("SHA256:b", None)
+    assert cache.get("10.0.0.2", "ssh-ed25519") is None
+    assert [change[2:] for change in Q1.host_key_changes(path=path)] == [
+        ("ssh-ed25519", "SHA256:a", "ssh-ed25519", "SHA256:c")]
+
+
+def test_create_db_migrates_host_keys_keyed_by_ip(tmp_path):
+    path = str(tmp_path / "scan.db")
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.execute("CREATE TABLE ssh_host_keys (ip INTEGER PRIMARY KEY, key_type TEXT, fingerprint TEXT, "
+                     "banner TEXT, first_seen REAL, last_seen REAL)")
+        conn.execute("INSERT INTO ssh_host_keys VALUES (1, 'ssh-rsa', 'SHA256:a', NULL, 1.0, 2.0)")
+    conn.close()
+    Q1.create_db(path)
+    Q1.create_db(path)
+    cache = Q1.HostKeyCache(None, path)
+    cache.load()
+    assert cache.get("0.0.0.1", "ssh-rsa") == ("SHA256:a", None)
+
+
+async def scan_chunks(path, hosts, resume, stop_after=None):
+    """
+    Runs the checkpoint of one scan over the hosts and returns the hosts it handed
+    out, marking all of them done except the ones after `stop_after`.
+    """
+    writer = Q1.ResultWriter(path, flush_interval=0.01)
+    await writer.start()
+    checkpoint = Q1.ScanCheckpoint(writer, str(hosts), chunk_size=4, resume=resume, path=path)
+    checkpoint.open()
+    pending = []
+    async for ip, chunk in checkpoint.pending(hosts):
+        pending.append(ip)
+        if stop_after is None or len(pending) <= stop_after:
+            await checkpoint.host_done(chunk)
+    if stop_after is None:
+        await checkpoint.finish()
+    await writer.close()
+    return pending
+
+
+def test_scan_checkpoint_resume(tmp_path):
+    path = str(tmp_path / "scan.db")
+    Q1.create_db(path)
+    hosts = Q1.TargetSet.parse("10.0.0.0/28")
+    # The first run is interrupted halfway through the second chunk
+    assert asyncio.run(scan_chunks(path, hosts, resume=False, stop_after=6)) == list(hosts)
+    resumed = asyncio.run(scan_chunks(path, hosts, resume=True))
+    assert resumed == list(hosts)[4:]
+    # The resumed run finished, so the next one starts over
+    assert asyncio.run(scan_chunks(path, hosts, resume=True)) == list(hosts)
+
+
+def test_failed_host_leaves_its_chunk_for_resume(tmp_path, monkeypatch):
+    path = str(tmp_path / "scan.db")
+    Q1.create_db(path)
+    hosts = Q1.TargetSet.parse("10.0.0.0/28")
+    processed = []
+
+    async def process_ip(ip, scanner):
+        processed.append(ip)
+        if ip == "10.0.0.6":
+            raise RuntimeError("probe failed")
+
+    async def scan(resume):
+        writer = Q1.ResultWriter(path, flush_interval=0.01)
+        await writer.start()
+        checkpoint = Q1.ScanCheckpoint(writer, str(hosts), chunk_size=4, resume=resume, path=path)
+        checkpoint.open()
+        scanner = Q1.Scanner(writer, workers=2)
+        await scanner.run(hosts, checkpoint)
+        incomplete = checkpoint.incomplete_chunks()
+        checkpoint.close()
+        await writer.close()
+        return incomplete, scanner.metrics.errors
+
+    monkeypatch.setattr(Q1, "process_ip", process_ip)
+    assert asyncio.run(scan(resume=False)) == (1, 1)
+    del processed[:]
+    assert asyncio.run(scan(resume=True)) == (1, 1)
+    assert processed == list(hosts)[4:8]
+
+
+def test_ping_from_consecutive_event_loops():
+    assert asyncio.run(Q1.ping_ip("127.0.0.1"))
+    assert asyncio.run(Q1.ping_ip("127.0.0.1"))
+    assert len(Q1._icmp_engines) == 1
+
+
+class PasswordServer(asyncssh.SSHServer):
+    def begin_auth(self, username):
+        return True
+
+    def password_auth_supported(self):
+        return True
+
+    def validate_password(self, username, password):
+        return password == "password"
+
+
+def test_ssh_login_reports_the_host_key_of_failed_logins(monkeypatch):
+    key = asyncssh.generate_private_key("ssh-ed25519")
+    connect = asyncssh.connect
+
+    async def login(password, known_hosts):
+        server = await asyncssh.create_server(PasswordServer, "127.0.0.1", 0, server_host_keys=[key])
+        port = server.sockets[0].getsockname()[1]
+        monkeypatch.setattr(asyncssh, "connect", lambda ip, **options: connect(
+            ip, port=port, known_hosts=known_hosts, **options))
+        try:
+            return await Q1.ssh_login("127.0.0.1", password=password, retries=1)
+        finally:
+            server.close()
+
+    host_key = ("ssh-ed25519", key.get_fingerprint())
+    banner = f"SSH-2.0-AsyncSSH_{asyncssh.__version__}"
+    assert asyncio.run(login("password", None)) == (True, host_key, banner)
+    assert asyncio.run(login("wrong", None)) == (False, host_key, banner)
+    # An untrusted key is rejected, but still reported
+    assert asyncio.run(login("password", [])) == (False, host_key, banner)
+
+
+def test_result_writer_stops_at_a_failed_batch(tmp_path):
+    path = str(tmp_path / "scan.db")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE log (value INTEGER)")
+    conn.close()
+
+    async def write():
+        writer = Q1.ResultWriter(path, batch_size=2, flush_interval=0.01, retries=2, retry_delay=0)
+        await writer.start()
+        await writer.execute("INSERT INTO log VALUES (?)", (1,))
+        await writer.execute("INSERT INTO log VALUES (?)", (2,))
+        await writer.execute("INSERT INTO missing VALUES (?)", (3,))
+        await writer.execute("INSERT INTO log VALUES (?)", (4,))
+        await asyncio.sleep(0.1)
+        try:
+            await writer.execute("INSERT INTO log VALUES (?)", (5,))
+        except sqlite3.OperationalError:
+            pass
+        else:
+            raise AssertionError("execute() did not raise after the failed batch")
+        try:
+            await writer.close()
+        except sqlite3.OperationalError:
+            return
+        raise AssertionError("close() did not raise after the failed batch")
+
+    asyncio.run(write())
+    conn = sqlite3.connect(path)
+    assert conn.execute("SELECT value FROM log").fetchall() == [(1,), (2,)]
+    conn.close()
+
+
+def test_snapshot_hitlist_keeps_the_order_and_name(tmp_path):
+    candidates = tmp_path / "leases.txt"
+    candidates.write_text("iaaddr 2001:db8::5 {\n2001:db8::1 2001:db8::5 fe80::1\n")
+    sources = [f"@{candidates}", "2001:db8::3", "2001:db8:1::/126"]
+    snapshot = Q1.snapshot_hitlist(sources, exclude=["2001:db8:1::2"])
+    try:
+        original = Q1.HitList.load(sources, exclude=["2001:db8:1::2"])
+        copy = Q1.HitList.load(["@" + snapshot])
+        assert list(copy) == list(original) == [
+            "2001:db8::5", "2001:db8::1", "2001:db8::3", "2001:db8:1::1", "2001:db8:1::3"]
+        assert str(copy) == str(original)
+    finally:
+        os.remove(snapshot)
+
+
+def test_classify_ssh_error():
+    cases = [
+        (asyncssh.PermissionDenied("denied"), "permanent"),
+        (asyncssh.HostKeyNotVerifiable("untrusted"), "permanent"),
+        (asyncssh.DisconnectError(asyncssh.DISC_TOO_MANY_CONNECTIONS, "busy"), "transient"),
+        (asyncssh.DisconnectError(asyncssh.DISC_CONNECTION_LOST, "lost"), "transient"),
+        (asyncssh.ConnectionLost("lost"), "transient"),
+        (asyncssh.DisconnectError(asyncssh.DISC_PROTOCOL_ERROR, "protocol"), "permanent"),
+        (asyncssh.DisconnectError(asyncssh.DISC_BY_APPLICATION, "bye"), "permanent"),
+        (ConnectionRefusedError(errno.ECONNREFUSED, "refused"), "permanent"),
+        (OSError(errno.EHOSTUNREACH, "unreachable"), "permanent"),
+        (ConnectionResetError(errno.ECONNRESET, "reset"), "transient"),
+        (asyncio.TimeoutError(), "timeout"),
+        (TimeoutError(), "timeout"),
+    ]
+    assert [Q1.classify_ssh_error(error) for error, _ in cases] == [kind for _, kind in cases]
+
+
+def test_ssh_login_retries_transient_errors_within_the_deadline(monkeypatch):
+    attempts = []
+
+    async def connect(ip, **options):
+        attempts.append(time.monotonic())
+        if options.get("password") == "slow":
+            await asyncio.sleep(0.1)
+        raise asyncssh.ConnectionLost("dropped")
+
+    monkeypatch.setattr(asyncssh, "connect", connect)
+    metrics = Q1.ScanMetrics()
+    policy = Q1.RetryPolicy(retries=3, base_delay=0)
+    assert asyncio.run(Q1.ssh_login("10.0.0.1", policy=policy, metrics=metrics)) == (False, None, None)
+    assert len(attempts) == 3
+    assert metrics.ssh_failures == {("login", "ConnectionLost"): 1}
+
+    # The deadline cuts the retries short
+    del attempts[:]
+    policy = Q1.RetryPolicy(retries=10, base_delay=0, deadline=0.35)
+    started = time.monotonic()
+    assert asyncio.run(Q1.ssh_login("10.0.0.1", password="slow", policy=policy)) == (False, None, None)
+    # Attempts start at 0, 0.1, 0.2 and 0.3s, the last one cut off by the deadline
+    assert len(attempts) in (3, 4)
+    assert attempts[-1] - started < 0.35
+    assert time.monotonic() - started < 0.45
+
+
+def test_ssh_login_gives_up_on_permanent_errors_and_timeouts(monkeypatch):
+    attempts = []
+
+    async def connect(ip, **options):
+        attempts.append(ip)
+        if ip == "10.0.0.1":
+            raise asyncssh.PermissionDenied("denied")
+        await asyncio.sleep(10)
+
+    monkeypatch.setattr(asyncssh, "connect", connect)
+    policy = Q1.RetryPolicy(retries=3, base_delay=0, attempt_timeout=0.05)
+    assert asyncio.run(Q1.ssh_login("10.0.0.1", policy=policy)) == (False, None, None)
+    assert asyncio.run(Q1.ssh_login("10.0.0.2", policy=policy)) == (False, None, None)
+    assert attempts == ["10.0.0.1", "10.0.0.2"]
+
+
+def count_rows(path):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute("SELECT COUNT(*) FROM log").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_result_writer_flushes_by_size_and_by_time(tmp_path):
+    path = str(tmp_path / "scan.db")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE log (value INTEGER)")
+    conn.close()
+
+    async def write():
+        writer = Q1.ResultWriter(path, batch_size=3, flush_interval=0.3)
+        await writer.start()
+        # A full batch is committed without waiting for the interval
+        for value in range(4):
+            await writer.execute("INSERT INTO log VALUES (?)", (value,))
+        await asyncio.sleep(0.1)
+        full = count_rows(path)
+        # The rest waits for the interval
+        await asyncio.sleep(0.35)
+        flushed = count_rows(path)
+        await writer.close()
+        return full, flushed
+
+    assert asyncio.run(write()) == (3, 4)
+
+
+def test_result_writer_commits_in_queue_order_and_drains_on_close(tmp_path):
+    path = str(tmp_path / "scan.db")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE log (n INTEGER PRIMARY KEY, value INTEGER)")
+    conn.close()
+
+    async def write():
+        writer = Q1.ResultWriter(path, batch_size=4, flush_interval=60.0)
+        await writer.start()
+        for value in range(10):
+            if value % 3 == 2:
+                await writer.execute("UPDATE log SET value = value * 10 WHERE value = ?", (value - 1,))
+            else:
+                await writer.execute("INSERT INTO log (value) VALUES (?)", (value,))
+        await writer.close()
+
+    asyncio.run(write())
+    conn = sqlite3.connect(path)
+    assert [value for value, in conn.execute("SELECT value FROM log ORDER BY n")] == [0, 10, 3, 40, 6, 70, 9]
+    conn.close()
+
+
+def test_token_bucket_admits_a_burst_then_the_rate():
+    async def acquire(bucket, count):
+        started = time.monotonic()
+        times = []
+        for _ in range(count):
+            await bucket.acquire()
+            times.append(time.monotonic() - started)
+        return times
+
+    bucket = Q1.TokenBucket(rate=50, burst=5)
+    times = asyncio.run(acquire(bucket, 10))
+    assert times[4] < 0.01
+    # The other five come at the rate, one every 20ms
+    assert 0.09 <= times[9] < 0.15
+    assert bucket.granted == 10
+    assert bucket.waited >= 0.09
+    # The burst never drops below one token
+    assert Q1.TokenBucket(rate=50, burst=0.1).burst == 1.0
+
+
+def test_export_results_as_csv_and_jsonl(tmp_path):
+    path = str(tmp_path / "scan.db")
+    Q1.create_db(path)
+    banner = "SSH-2.0-OpenSSH_9.6"
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.executemany(Q1.SAVE_IP_SQL, [
+            (Q1.ip_to_int("10.0.0.1"), 1, 1, 1, 1.0, banner, *Q1.parse_ssh_banner(banner)),
+            (Q1.ip_to_int("10.0.0.2"), 0, 0, 0, 2.0, None, None, None),
+            (Q1.ip_to_int("10.0.1.1"), 1, 0, 0, 3.0, None, None, None)])
+    conn.close()
+
+    output = str(tmp_path / "active.csv")
+    assert Q1.export_results(output, state="active", path=path) == 2
+    with open(output, newline="") as f:
+        assert list(csv.reader(f)) == [list(Q1.RESULT_COLUMNS),
+                                       ["10.0.0.1", "1", "1", "1", "1.0", "OpenSSH", "9.6"],
+                                       ["10.0.1.1", "1", "0", "0", "3.0", "", ""]]
+
+    output = str(tmp_path / "subnet.jsonl")
+    assert Q1.export_results(output, cidr="10.0.0.0/24", path=path) == 2
+    with open(output) as f:
+        assert [json.loads(line) for line in f] == [
+            {"ip": "10.0.0.1", "is_active": 1, "is_ssh_connected": 1, "is_ssh_port_open": 1, "last_seen": 1.0,
+             "ssh_software": "OpenSSH", "ssh_version": "9.6"},
+            {"ip": "10.0.0.2", "is_active": 0, "is_ssh_connected": 0, "is_ssh_port_open": 0, "last_seen": 2.0,
+             "ssh_software": None, "ssh_version": None}]
+
+    try:
+        Q1.export_results(str(tmp_path / "results.xml"), path=path)
+    except ValueError:
+        return
+    raise AssertionError("an unknown format did not raise")
+
+
+def test_parse_ssh_banner():
+    assert Q1.parse_ssh_banner("SSH-2.0-OpenSSH_8.9p1 Ubuntu-3ubuntu0.6") == ("OpenSSH", "8.9p1")
+    assert Q1.parse_ssh_banner("SSH-2.0-dropbear_2022.83") == ("dropbear", "2022.83")
+    assert Q1.parse_ssh_banner("SSH-1.99-Cisco-1.25") == ("Cisco-1.25", None)
+    assert Q1.parse_ssh_banner("SSH-2.0-AsyncSSH_2.14.0") == ("AsyncSSH", "2.14.0")
+    assert Q1.parse_ssh_banner("HTTP/1.1 400 Bad Request") == (None, None)
+    assert Q1.parse_ssh_banner(None) == (None, None)
+
+
+def test_hitlist_address():
+    assert str(Q1.hitlist_address("2001:DB8:0::5")) == "2001:db8::5"
+    for token in ("fe80::1", "ff02::1", "::", "10.0.0.1", "2001:db8::zz", "::1:"):
+        assert Q1.hitlist_address(token) is None
+
+
+def test_read_hitlist_file(tmp_path):
+    log = tmp_path / "dhcp.log"
+    log.write_text(
+        "2001:db8::1\n"
+        "Jan 1 00:00:00 dnsmasq-dhcp[1]: DHCPREPLY(eth0) 2001:db8::5 00:01:00:01:2c:3a:11:22:52:54:00:12:34:56\n"
+        "  iaaddr 2001:db8::7 {\n"
+        "fe80::1 ff02::2  # 2001:db8::9 is commented out\n"
+        "2001:db8::1 12:00:30\n")
+    assert [str(address) for address in Q1.read_hitlist_file(str(log))] == [
+        "2001:db8::1", "2001:db8::5", "2001:db8::7", "2001:db8::1"]
@@ -1,82 +1,553 @@
 import asyncio
+import collections
+import ipaddress
 import subprocess
 import logging
+import random
+import re
 import time
 
+from icmp_echo import ICMPEchoEngine, RTTEstimator
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
-async def ping_ip(ip, timeout=2):
+async def ping_rtt(ip, timeout=2):
     """
-    Pings the specified IP address to check if it's reachable.
+    Pings the specified IP address and measures the round-trip time.
     The ping will timeout if no response is received within the given time.
 
     Args:
         ip (str): The IP address to ping.
-        timeout (int): Timeout duration in seconds for the ping.
+        timeout (float): Timeout duration in seconds for the ping.
 
     Returns:
-        bool: True if the IP is reachable, False if not (including timeout).
+        float: The round-trip time in seconds, or None if the IP is not reachable (including timeout).
     """
     try:
-        result = await asyncio.to_thread(subprocess.run, ['ping', '-c', '1', '-W', str(timeout), ip],
+        result = await asyncio.to_thread(subprocess.run, ['ping', '-c', '1', '-W', f'{timeout:.3f}', ip],
                                          stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        return result.returncode == 0
     except Exception as e:
         logger.warning(f"Ping failed for {ip}: {e}")
-        return False
+        return None
+    if result.returncode != 0:
+        return None
+    match = re.search(rb'time[=<]([\d.]+) ms', result.stdout)
+    return float(match.group(1)) / 1000 if match else timeout
 
 
-async def check_ips(ips):
+async def ping_ip(ip, timeout=2):
     """
-    Checks the reachability of a list of IP addresses by pinging each one.
-    Prints the IPs that are not reachable.
+    Pings the specified IP address to check if it's reachable.
+    The ping will timeout if no response is received within the given time.
 
     Args:
-        ips (list): List of IP addresses to check.
-    """
-    unreachable_ips = []
-    tasks = []
-
-    for ip in ips:
-        tasks.append(check_single_ip(ip, unreachable_ips))
-
-    await asyncio.gather(*tasks)
+        ip (str): The IP address to ping.
+        timeout (float): Timeout duration in seconds for the ping.
 
-    if unreachable_ips:
-        logger.info("Unreachable IPs:")
-        for ip in unreachable_ips:
-            logger.info(f"- {ip}")
-    else:
-        logger.info("All IPs are reachable!")
+    Returns:
+        bool: True if the IP is reachable, False if not (including timeout).
+    """
+    return await ping_rtt(ip, timeout) is not None
 
 
-async def check_single_ip(ip, unreachable_ips):
+async def check_single_ip(ip, unreachable_ips, estimator=None, prober=None):
     """
     Pings a single IP address and adds it to the unreachable_ips list if it's not reachable.
 
     Args:
         ip (str): The IP address to ping.
         unreachable_ips (list): List to store unreachable IPs.
+        estimator (RTTEstimator): If given, sets the ping timeout and receives the RTT sample or timeout.
+        prober (ICMPEchoEngine): If given, the ping is sent through it instead of the ping command.
+
+    Returns:
+        float: The round-trip time in seconds, or None if the IP is not reachable.
     """
-    if not await ping_ip(ip):
+    timeout = estimator.timeout(ip) if estimator is not None else 2
+    if prober is not None:
+        rtt = await prober.ping(ip, timeout)
+    else:
+        rtt = await ping_rtt(ip, timeout)
+    if rtt is None:
         unreachable_ips.append(ip)
+        if estimator is not None:
+            estimator.timed_out(ip)
+    elif estimator is not None:
+        estimator.observe(ip, rtt)
+    return rtt
 
 
-async def monitor_ips():
+class HostState:
     """
-    Continuously monitors a list of IP addresses by pinging them at regular intervals.
+    Tracked state of one monitored host.
+    """
+
+    __slots__ = ('status', 'reported', 'failures', 'successes', 'penalty', 'updated', 'suppressed')
+
+    def __init__(self):
+        self.status = "unknown"
+        self.reported = "unknown"
+        self.failures = 0
+        self.successes = 0
+        self.penalty = 0.0
+        self.updated = 0.0
+        self.suppressed = False
+
+
+class HostStateTracker:
+    """
+    Turns per-probe results into up/down transitions. A host only goes down after
+    `down_after` consecutive failures and back up after `up_after` consecutive
+    successes. Every change of state adds a penalty that decays with a half-life,
+    as in BGP route flap damping (RFC 2439): while the penalty is above the
+    suppress limit the host counts as flapping and its transitions are held back,
+    until the penalty decays below the reuse limit and its current state is reported.
+
+    Reported transitions are numbered, so consumers can poll the changes since the
+    last version they saw instead of rereading the state of every host.
+    """
+
+    def __init__(self, down_after=3, up_after=1, half_life=60.0, penalty=1.0, suppress=3.0, reuse=1.5,
+                 history=10000):
+        """
+        Initializes a tracker without hosts.
+
+        Args:
+            down_after (int): Consecutive failures before a host is reported down.
+            up_after (int): Consecutive successes before a host is reported up.
+            half_life (float): Seconds for a flap penalty to decay by half.
+            penalty (float): Penalty added by every change of state.
+            suppress (float): Penalty above which a host's transitions are held back.
+            reuse (float): Penalty below which a flapping host is reported again.
+            history (int): Number of transitions kept for changes_since().
+        """
+        self.down_after = down_after
+        self.up_after = up_after
+        self.half_life = half_life
+        self.penalty = penalty
+        self.suppress = suppress
+        self.reuse = reuse
+        self.version = 0
+        self._hosts = {}
+        self._changes = collections.deque(maxlen=history)
+
+    def record(self, ip, reachable, now=None):
+        """
+        Adds the result of one probe.
+
+        Args:
+            ip (str): The probed IP address.
+            reachable (bool): Whether the host answered.
+            now (float): Monotonic time of the result, time.monotonic() if None.
+
+        Returns:
+            tuple: The reported transition (version, ip, old, new, at), or None if
+            nothing is reported.
+        """
+        now = time.monotonic() if now is None else now
+        state = self._hosts.get(ip)
+        if state is None:
+            state = self._hosts[ip] = HostState()
+            state.updated = now
+        state.penalty *= 0.5 ** ((now - state.updated) / self.half_life)
+        state.updated = now
+
+        if reachable:
+            state.successes += 1
+            state.failures = 0
+            status = "up" if state.successes >= self.up_after else state.status
+        else:
+            state.failures += 1
+            state.successes = 0
+            status = "down" if state.failures >= self.down_after else state.status
+        if status != state.status:
+            if state.status != "unknown":
+                state.penalty += self.penalty
+            state.status = status
+
+        if state.suppressed and state.penalty < self.reuse:
+            state.suppressed = False
+            logger.info(f"Host {ip} stopped flapping")
+        elif not state.suppressed and state.penalty > self.suppress:
+            state.suppressed = True
+            logger.warning(f"Host {ip} is flapping, holding back its transitions")
+        if state.suppressed or state.status == state.reported:
+            return None
+        self.version += 1
+        change = (self.version, ip, state.reported, state.status, time.time())
+        state.reported = state.status
+        self._changes.append(change)
+        return change
+
+    def changes_since(self, version):
+        """
+        Returns the transitions reported after the given version.
+
+        Args:
+            version (int): The last version the caller has seen, 0 for all of them.
+
+        Returns:
+            list: (version, ip, old, new, at) tuples in order, or None if some of them
+            were already dropped from the history and the caller must take a snapshot.
+        """
+        if self._changes and self._changes[0][0] > version + 1:
+            return None
+        return [change for change in self._changes if change[0] > version]
+
+    def snapshot(self):
+        """
+        Returns a compact view of the reported state: counts for every status and
+        only the hosts that are not up listed by address.
+
+        Returns:
+            dict: "version", "counts" (status -> hosts), "down" (sorted IPs) and
+            "flapping" (sorted IPs whose transitions are being held back).
+        """
+        counts = dict.fromkeys(("up", "down", "unknown"), 0)
+        down = []
+        flapping = []
+        for ip, state in self._hosts.items():
+            counts[state.reported] += 1
+            if state.reported == "down":
+                down.append(ip)
+            if state.suppressed:
+                flapping.append(ip)
+        sort_key = ipaddress.ip_address
+        return {"version": self.version, "counts": counts, "down": sorted(down, key=sort_key),
+                "flapping": sorted(flapping, key=sort_key)}
+
+
+class RTTSeries:
     """
+    Fixed-size time series of every host's last probes: one preallocated uint16 row
+    per host and one column per sample slot, written as a ring. RTTs are stored in
+    units of `resolution` seconds; the two largest values mark lost probes and
+    empty slots, so sorting a row puts the valid RTTs first. Rolling percentiles
+    and loss are computed with numpy over blocks of rows, and hosts are stored in
+    address order so every subnet is a contiguous block.
+
+    100k hosts x 720 slots (one hour at 5 s) take 144 MB, allocated up front.
+    """
+
+    LOST = 0xfffe
+    EMPTY = 0xffff
 
-    ips = [f"172.29.0.{i}" for i in range(1, 513)]
+    def __init__(self, ips, slots=720, resolution=0.0001, prefixlen=24, block=8192):
+        """
+        Allocates the series.
 
+        Args:
+            ips (list): The monitored IPv4 addresses.
+            slots (int): Number of samples kept per host.
+            resolution (float): RTT unit in seconds; RTTs are capped at 65533 units.
+            prefixlen (int): Prefix length of the subnets aggregated by subnet_stats().
+            block (int): Number of rows processed at once, bounding the temporary memory.
+
+        Raises:
+            RuntimeError: If numpy is not installed.
+        """
+        try:
+            import numpy
+        except ImportError:
+            raise RuntimeError("The RTT history needs numpy, install it with: pip install numpy")
+        self.np = numpy
+        addresses = sorted(map(ipaddress.IPv4Address, set(ips)))
+        self.ips = [str(address) for address in addresses]
+        self.rows = {ip: row for row, ip in enumerate(self.ips)}
+        self.slots = slots
+        self.resolution = resolution
+        self.prefixlen = prefixlen
+        self.block = block
+        self.samples = numpy.full((len(self.ips), slots), self.EMPTY, dtype=numpy.uint16)
+        self.cursor = numpy.zeros(len(self.ips), dtype=numpy.uint16 if slots <= 0xffff else numpy.uint32)
+        subnets = numpy.array([int(address) >> (32 - prefixlen) for address in addresses], dtype=numpy.int64)
+        self.subnet_starts = numpy.flatnonzero(numpy.r_[True, subnets[1:] != subnets[:-1]]) if len(subnets) else subnets
+        self.subnets = subnets[self.subnet_starts]
+
+    def record(self, ip, rtt):
+        """
+        Stores the result of one probe in the host's next slot.
+
+        Args:
+            ip (str): The probed IP address.
+            rtt (float): The round-trip time in seconds, or None if the probe was lost.
+        """
+        row = self.rows[ip]
+        value = self.LOST if rtt is None else min(round(rtt / self.resolution), self.LOST - 1)
+        column = self.cursor[row]
+        self.samples[row, column] = value
+        self.cursor[row] = (column + 1) % self.slots
+
+    def _percentiles(self, block, quantiles):
+        """
+        Computes linearly interpolated percentiles of the valid RTTs of every row.
+
+        Args:
+            block (numpy.ndarray): Rows of samples.
+            quantiles (tuple): Quantiles between 0 and 1.
+
+        Returns:
+            tuple: (percentiles, lost, valid) where percentiles has one column per
+            quantile in seconds, NaN for rows without RTTs.
+        """
+        np = self.np
+        ordered = np.sort(block, axis=1)
+        answered = (ordered < self.LOST).sum(axis=1)
+        lost = (ordered == self.LOST).sum(axis=1)
+        result = np.full((len(block), len(quantiles)), np.nan)
+        has = answered > 0
+        rows = ordered[has].astype(np.float64)
+        last = answered[has] - 1
+        for i, q in enumerate(quantiles):
+            position = q * last
+            low = np.floor(position).astype(np.int64)
+            high = np.minimum(low + 1, last)
+            low_value = np.take_along_axis(rows, low[:, None], axis=1)[:, 0]
+            high_value = np.take_along_axis(rows, high[:, None], axis=1)[:, 0]
+            result[has, i] = (low_value + (high_value - low_value) * (position - low)) * self.resolution
+        return result, lost, answered + lost
+
+    def host_stats(self, quantiles=(0.5, 0.95, 0.99)):
+        """
+        Returns the rolling RTT percentiles and loss of every host over its stored samples.
+
+        Args:
+            quantiles (tuple): Quantiles between 0 and 1.
+
+        Returns:
+            list: (ip, percentiles, loss_percent) tuples in address order, where
+            percentiles is a tuple of seconds, with None for hosts that never answered,
+            and loss_percent is None for hosts without samples.
+        """
+        stats = []
+        for start in range(0, len(self.ips), self.block):
+            result, lost, probed = self._percentiles(self.samples[start:start + self.block], quantiles)
+            loss = self.np.where(probed > 0, 100.0 * lost / self.np.maximum(probed, 1), self.np.nan)
+            for offset in range(len(result)):
+                stats.append(self._format(self.ips[start + offset], result[offset], loss[offset]))
+        return stats
+
+    def subnet_stats(self, quantiles=(0.5, 0.95, 0.99)):
+        """
+        Returns the rolling RTT percentiles and loss of every subnet, pooling the
+        stored samples of all its hosts.
+
+        Args:
+            quantiles (tuple): Quantiles between 0 and 1.
+
+        Returns:
+            list: (subnet, percentiles, loss_percent) tuples in address order, with
+            percentiles and loss as in host_stats().
+        """
+        np = self.np
+        stats = []
+        bounds = list(self.subnet_starts) + [len(self.ips)]
+        for prefix, start, stop in zip(self.subnets, bounds, bounds[1:]):
+            pooled = self.samples[start:stop].reshape(1, -1)
+            result, lost, probed = self._percentiles(pooled, quantiles)
+            loss = 100.0 * lost[0] / probed[0] if probed[0] else np.nan
+            network = ipaddress.IPv4Network((int(prefix) << (32 - self.prefixlen), self.prefixlen))
+            stats.append(self._format(str(network), result[0], loss))
+        return stats
+
+    def _format(self, name, percentiles, loss):
+        percentiles = None if self.np.isnan(percentiles[0]) else tuple(float(value) for value in percentiles)
+        return name, percentiles, None if self.np.isnan(loss) else float(loss)
+
+
+async def report_history(series, interval=60.0):
+    """
+    Periodically logs the rolling RTT percentiles and loss of every subnet until cancelled.
+
+    Args:
+        series (RTTSeries): The history to summarize.
+        interval (float): Seconds between reports.
+    """
     while True:
-        logger.info("Starting new round of IP checks...")
-        await check_ips(ips)
-        logger.info("Waiting for next round...\n")
+        await asyncio.sleep(interval)
+        stats = await asyncio.to_thread(series.subnet_stats)
+        for subnet, percentiles, loss in stats:
+            if loss is None:
+                continue
+            if percentiles is None:
+                logger.info(f"{subnet}: no answers, loss {loss:.1f}%")
+            else:
+                p50, p95, p99 = (value * 1000 for value in percentiles)
+                logger.info(f"{subnet}: RTT p50 {p50:.2f} ms, p95 {p95:.2f} ms, p99 {p99:.2f} ms, "
+                            f"loss {loss:.1f}%")
+
+
+class ProbeScheduler:
+    """
+    Runs rounds of checks on an absolute fixed-rate clock: round k starts at
+    start + k * interval however long earlier probes took, so the period does not
+    drift. Within a round every host is probed at its own offset, spread evenly
+    (or evenly with per-round jitter) across the interval, which keeps the packet
+    rate steady and samples each host once per interval.
 
-        await asyncio.sleep(5)
+    Probes sent later than the tolerance past their deadline are reported as missed
+    deadlines. A host whose previous probe is still in flight is skipped for the round.
+    """
+
+    def __init__(self, ips, interval=5.0, spread="even", tolerance=0.1, seed=None):
+        """
+        Initializes the scheduler.
+
+        Args:
+            ips (list): The IP addresses to probe every round.
+            interval (float): Seconds between the starts of consecutive rounds.
+            spread (str): "even" for fixed, equally spaced offsets, "jitter" to move each
+                probe randomly within its slot every round.
+            tolerance (float): Seconds a probe may be late before it counts as a missed deadline.
+            seed (int): Seed of the jitter.
+        """
+        self.ips = ips
+        self.interval = interval
+        self.spread = spread
+        self.tolerance = tolerance
+        self.missed = 0
+        self.skipped_rounds = 0
+        self._random = random.Random(seed)
+        self._in_flight = {}
+        self._rounds = set()
+
+    def offsets(self):
+        """
+        Returns the offset of every host's probe into the next round.
+
+        Returns:
+            list: (offset, ip) pairs in ascending offset order.
+        """
+        slot = self.interval / max(len(self.ips), 1)
+        if self.spread == "jitter":
+            return [((i + self._random.random()) * slot, ip) for i, ip in enumerate(self.ips)]
+        return [(i * slot, ip) for i, ip in enumerate(self.ips)]
+
+    async def run(self, check, rounds=None):
+        """
+        Probes the hosts round after round until cancelled or the given number of
+        rounds has started. Each round's results are logged once all its probes are done.
+
+        Args:
+            check (callable): Coroutine function called as check(ip, unreachable_ips) for every probe.
+            rounds (int): Number of rounds to run, forever if None.
+        """
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        number = 0
+        try:
+            while rounds is None or number < rounds:
+                round_start = start + number * self.interval
+                behind = loop.time() - round_start
+                if behind >= self.interval:
+                    skipped = int(behind // self.interval)
+                    logger.warning(f"Fell {skipped} round(s) behind schedule, skipping them")
+                    self.skipped_rounds += skipped
+                    number += skipped
+                    continue
+
+                logger.info(f"Starting round {number} of IP checks...")
+                unreachable_ips = []
+                tasks = []
+                missed = skipped = 0
+                max_late = 0.0
+                for offset, ip in self.offsets():
+                    deadline = round_start + offset
+                    delay = deadline - loop.time()
+                    # Sleeping for less than the timer resolution would only add overhead
+                    if delay > 0.001:
+                        await asyncio.sleep(delay)
+                    late = loop.time() - deadline
+                    previous = self._in_flight.get(ip)
+                    if previous is not None and not previous.done():
+                        skipped += 1
+                        continue
+                    if late > self.tolerance:
+                        missed += 1
+                        max_late = max(max_late, late)
+                    task = asyncio.create_task(check(ip, unreachable_ips))
+                    self._in_flight[ip] = task
+                    tasks.append(task)
+                self.missed += missed
+                finisher = asyncio.create_task(self._finish(number, tasks, unreachable_ips, missed, skipped, max_late))
+                self._rounds.add(finisher)
+                finisher.add_done_callback(self._rounds.discard)
+                number += 1
+                await asyncio.sleep(max(0.0, start + number * self.interval - loop.time()))
+            await asyncio.gather(*self._rounds)
+        finally:
+            for task in (*self._rounds, *self._in_flight.values()):
+                task.cancel()
+
+    async def _finish(self, number, tasks, unreachable_ips, missed, skipped, max_late):
+        """
+        Waits for the probes of a round and logs its results and missed deadlines.
+        """
+        await asyncio.gather(*tasks)
+        logger.info(f"Round {number} finished: {len(unreachable_ips)}/{len(tasks)} probes unanswered")
+        if missed or skipped:
+            logger.warning(f"Round {number}: {missed} probes missed their deadline by more than "
+                           f"{self.tolerance}s (up to {max_late:.3f}s late), {skipped} skipped "
+                           f"while the previous probe was still in flight")
+
+
+async def monitor_ips(timeout_floor=0.05, timeout_ceiling=2.0, interval=5.0, spread="even", tracker=None,
+                      history_slots=720, report_interval=60.0):
+    """
+    Continuously monitors a list of IP addresses by pinging them at regular intervals.
+    Ping timeouts adapt to the round-trip times observed in each subnet. All rounds
+    share one ICMP prober; the ping command is only used if no ICMP socket can be opened.
+    Rounds run on a fixed-rate schedule with the probes spread across the interval.
+    Only hosts going up or down are logged, not every unreachable host of every round.
+
+    Args:
+        timeout_floor (float): Minimum ping timeout in seconds.
+        timeout_ceiling (float): Maximum ping timeout in seconds.
+        interval (float): Seconds between the starts of consecutive rounds.
+        spread (str): "even" or "jitter" placement of the probes within a round.
+        tracker (HostStateTracker): Receives the probe results, for consumers of its
+            snapshot and changes; a default tracker is used if None.
+        history_slots (int): Number of rounds of RTT and loss history kept per host, none if 0.
+        report_interval (float): Seconds between the per-subnet RTT and loss reports.
+    """
+
+    ips = [str(ip) for ip in ipaddress.IPv4Network("172.29.0.0/23").hosts()]
+    estimator = RTTEstimator(timeout_floor, timeout_ceiling)
+    prober = ICMPEchoEngine()
+    try:
+        prober.open()
+    except OSError as e:
+        logger.warning(f"ICMP socket unavailable, falling back to the ping command: {e}")
+        prober = None
+
+    scheduler = ProbeScheduler(ips, interval, spread)
+    tracker = tracker or HostStateTracker()
+    series = None
+    if history_slots:
+        try:
+            series = RTTSeries(ips, history_slots)
+        except RuntimeError as e:
+            logger.warning(f"Keeping no RTT history: {e}")
+    reporter = asyncio.create_task(report_history(series, report_interval)) if series is not None else None
+
+    async def check(ip, unreachable_ips):
+        rtt = await check_single_ip(ip, unreachable_ips, estimator, prober)
+        if series is not None:
+            series.record(ip, rtt)
+        change = tracker.record(ip, rtt is not None)
+        # The first "up" of every host at startup is not worth a log line
+        if change is not None and (change[2] != "unknown" or change[3] == "down"):
+            logger.info(f"Host {ip} is {change[3]} (was {change[2]})")
+
+    try:
+        await scheduler.run(check)
+    finally:
+        if reporter is not None:
+            reporter.cancel()
+        if prober is not None:
+            prober.close()
 
 if __name__ == "__main__":
     asyncio.run(monitor_ips())
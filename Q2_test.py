@@ -0,0 +1,155 @@
+import asyncio
+import random
+import time
+
+import pytest
+
+import Q2
+
+
+def record_all(tracker, ip, results, start=0.0):
+    """
+    Records the probe results one second apart and returns the reported (old, new)
+    transitions, None where nothing was reported.
+    """
+    changes = []
+    for offset, reachable in enumerate(results):
+        change = tracker.record(ip, reachable, now=start + offset)
+        changes.append(change and change[2:4])
+    return changes
+
+
+def test_host_goes_down_after_consecutive_failures():
+    tracker = Q2.HostStateTracker(down_after=3, up_after=1)
+    assert record_all(tracker, "10.0.0.1", [True, False, False, True, False, False, False]) == [
+        ("unknown", "up"), None, None, None, None, None, ("up", "down")]
+    assert tracker.snapshot()["down"] == ["10.0.0.1"]
+
+
+def test_host_comes_back_up_after_consecutive_successes():
+    tracker = Q2.HostStateTracker(down_after=1, up_after=2)
+    assert record_all(tracker, "10.0.0.1", [False, True, False, True, True]) == [
+        ("unknown", "down"), None, None, None, ("down", "up")]
+    assert tracker.snapshot()["counts"] == {"up": 1, "down": 0, "unknown": 0}
+
+
+def test_flapping_host_is_suppressed_until_its_penalty_decays():
+    tracker = Q2.HostStateTracker(down_after=1, up_after=1, half_life=60.0, penalty=1.0, suppress=3.0, reuse=1.5)
+    assert record_all(tracker, "10.0.0.1", [True, False, True, False, True, False]) == [
+        ("unknown", "up"), ("up", "down"), ("down", "up"), ("up", "down"), None, None]
+    assert tracker.snapshot()["flapping"] == ["10.0.0.1"]
+    # Still above the reuse limit a minute and a half later, and the host went up again
+    assert tracker.record("10.0.0.1", True, now=100.0) is None
+    assert tracker.snapshot()["down"] == ["10.0.0.1"]
+    # Below it after another 100s, when the current state is reported
+    assert tracker.record("10.0.0.1", True, now=200.0)[2:4] == ("down", "up")
+    assert tracker.snapshot()["flapping"] == []
+
+
+def test_changes_since():
+    tracker = Q2.HostStateTracker(down_after=1, history=3)
+    record_all(tracker, "10.0.0.1", [True, False])
+    record_all(tracker, "10.0.0.2", [True])
+    assert [change[0] for change in tracker.changes_since(0)] == [1, 2, 3]
+    assert [change[0] for change in tracker.changes_since(2)] == [3]
+    assert tracker.changes_since(3) == []
+    # The first transition drops out of the history
+    record_all(tracker, "10.0.0.2", [False], start=10.0)
+    assert tracker.changes_since(0) is None
+    assert [change[0] for change in tracker.changes_since(1)] == [2, 3, 4]
+    assert tracker.snapshot()["version"] == 4
+
+
+def expected_stats(results, quantiles, resolution):
+    """
+    Computes the percentiles and loss of the given probe results with
+    numpy.percentile, on RTTs rounded to the series' resolution.
+    """
+    import numpy
+    rtts = [round(rtt / resolution) * resolution for rtt in results if rtt is not None]
+    percentiles = tuple(numpy.percentile(rtts, [100 * q for q in quantiles])) if rtts else None
+    loss = 100.0 * (len(results) - len(rtts)) / len(results) if results else None
+    return percentiles, loss
+
+
+def assert_stats(actual, expected):
+    assert actual[0] == expected[0]
+    if expected[1] is None:
+        assert actual[1] is None
+    else:
+        assert actual[1] == pytest.approx(expected[1], abs=1e-9)
+    assert actual[2] == pytest.approx(expected[2])
+
+
+def test_rtt_series_matches_numpy_percentile():
+    random.seed(7)
+    quantiles = (0.0, 0.25, 0.5, 0.95, 0.99, 1.0)
+    ips = [f"10.0.{subnet}.{host}" for subnet in range(3) for host in range(1, 8)]
+    series = Q2.RTTSeries(ips, slots=10, block=4)
+    history = {ip: [] for ip in ips}
+    for ip in ips:
+        # Some hosts wrap around the ring, some never fill it
+        for _ in range(random.randrange(3, 25)):
+            rtt = None if random.random() < 0.2 else random.uniform(0.0005, 0.2)
+            series.record(ip, rtt)
+            history[ip].append(rtt)
+    history = {ip: results[-10:] for ip, results in history.items()}
+
+    for actual, ip in zip(series.host_stats(quantiles), ips, strict=True):
+        assert_stats(actual, (ip,) + expected_stats(history[ip], quantiles, series.resolution))
+    for actual, subnet in zip(series.subnet_stats(quantiles), range(3), strict=True):
+        pooled = [rtt for ip in ips if ip.startswith(f"10.0.{subnet}.") for rtt in history[ip]]
+        assert_stats(actual, (f"10.0.{subnet}.0/24",) + expected_stats(pooled, quantiles, series.resolution))
+
+
+def test_rtt_series_without_answers():
+    series = Q2.RTTSeries(["10.0.0.1", "10.0.0.2", "10.0.1.1"], slots=4)
+    for _ in range(6):
+        series.record("10.0.0.2", None)
+    assert series.host_stats() == [("10.0.0.1", None, None), ("10.0.0.2", None, 100.0), ("10.0.1.1", None, None)]
+    assert series.subnet_stats() == [("10.0.0.0/24", None, 100.0), ("10.0.1.0/24", None, None)]
+    # The lost probes leave the ring once it wraps around
+    for _ in range(4):
+        series.record("10.0.0.2", 0.01)
+    assert series.host_stats()[1] == ("10.0.0.2", (0.01, 0.01, 0.01), 0.0)
+
+
+def test_probe_scheduler_offsets():
+    ips = ["10.0.0.1", "10.0.0.2", "10.0.0.3", "10.0.0.4"]
+    scheduler = Q2.ProbeScheduler(ips, interval=2.0)
+    assert scheduler.offsets() == [(0.0, ips[0]), (0.5, ips[1]), (1.0, ips[2]), (1.5, ips[3])]
+    jittered = Q2.ProbeScheduler(ips, interval=2.0, spread="jitter", seed=1)
+    first, second = jittered.offsets(), jittered.offsets()
+    assert first != second
+    for offsets in (first, second):
+        assert [ip for _, ip in offsets] == ips
+        assert all(i * 0.5 <= offset < (i + 1) * 0.5 for i, (offset, _) in enumerate(offsets))
+
+
+def test_probe_scheduler_skips_rounds_it_fell_behind_on():
+    checks = []
+
+    async def check(ip, unreachable_ips):
+        checks.append(ip)
+        if len(checks) == 1:
+            # Blocks the event loop past the start of the next round
+            time.sleep(0.13)
+
+    scheduler = Q2.ProbeScheduler(["10.0.0.1"], interval=0.05)
+    asyncio.run(scheduler.run(check, rounds=4))
+    assert scheduler.skipped_rounds == 1
+    assert len(checks) == 3
+
+
+def test_probe_scheduler_skips_hosts_still_in_flight():
+    checks = []
+
+    async def check(ip, unreachable_ips):
+        checks.append(ip)
+        await asyncio.sleep(0.08 if ip == "10.0.0.1" else 0)
+
+    scheduler = Q2.ProbeScheduler(["10.0.0.1", "10.0.0.2"], interval=0.05)
+    asyncio.run(scheduler.run(check, rounds=4))
+    assert checks.count("10.0.0.1") == 2
+    assert checks.count("10.0.0.2") == 4
+    assert scheduler.skipped_rounds == 0
@@ -0,0 +1,253 @@
+import asyncio
+import ipaddress
+import logging
+import os
+import socket
+import struct
+import time
+
+logger = logging.getLogger(__name__)
+
+ICMP_ECHO_REPLY = 0
+ICMP_ECHO_REQUEST = 8
+ICMP6_ECHO_REQUEST = 128
+ICMP6_ECHO_REPLY = 129
+
+
+def icmp_checksum(data):
+    """
+    Computes the RFC 1071 internet checksum of an ICMP message.
+
+    Args:
+        data (bytes): The ICMP header and payload with a zeroed checksum field.
+
+    Returns:
+        int: The 16-bit one's complement checksum.
+    """
+    if len(data) % 2:
+        data += b'\x00'
+    total = sum(struct.unpack(f'!{len(data) // 2}H', data))
+    total = (total >> 16) + (total & 0xffff)
+    total += total >> 16
+    return ~total & 0xffff
+
+
+class ICMPEchoEngine:
+    """
+    Sends ICMP echo requests from a single socket and matches the replies back to
+    the waiting coroutines by address and sequence number.
+
+    An unprivileged datagram ICMP socket is used when the kernel allows it
+    (net.ipv4.ping_group_range), otherwise a raw socket is opened. An engine
+    speaks either ICMP or ICMPv6, depending on its address family.
+    """
+
+    def __init__(self, receive_buffer=4 * 1024 * 1024, family=socket.AF_INET):
+        """
+        Initializes the engine without opening the socket.
+
+        Args:
+            receive_buffer (int): Requested SO_RCVBUF size, so reply bursts are not dropped.
+            family (int): socket.AF_INET for ICMP echo, socket.AF_INET6 for ICMPv6 echo.
+        """
+        self.receive_buffer = receive_buffer
+        self.family = family
+        if family == socket.AF_INET6:
+            self._proto, self._request, self._reply = socket.IPPROTO_ICMPV6, ICMP6_ECHO_REQUEST, ICMP6_ECHO_REPLY
+        else:
+            self._proto, self._request, self._reply = socket.IPPROTO_ICMP, ICMP_ECHO_REQUEST, ICMP_ECHO_REPLY
+        self._sock = None
+        self._raw = False
+        self._loop = None
+        self._ident = os.getpid() & 0xffff
+        self._seq = 0
+        self._pending = {}
+
+    def open(self):
+        """
+        Opens the ICMP socket and registers it with the running event loop.
+
+        Raises:
+            OSError: If neither a datagram nor a raw ICMP socket can be created.
+        """
+        try:
+            sock = socket.socket(self.family, socket.SOCK_DGRAM, self._proto)
+        except PermissionError:
+            sock = socket.socket(self.family, socket.SOCK_RAW, self._proto)
+            self._raw = True
+        sock.setblocking(False)
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.receive_buffer)
+        except OSError:
+            pass
+        self._sock = sock
+        self._loop = asyncio.get_running_loop()
+        self._loop.add_reader(sock.fileno(), self._on_readable)
+
+    def close(self):
+        """
+        Unregisters and closes the socket, resolving any probes still in flight as lost.
+        """
+        if self._sock is None:
+            return
+        self._loop.remove_reader(self._sock.fileno())
+        self._sock.close()
+        self._sock = None
+        for future in self._pending.values():
+            if not future.done():
+                future.set_result(None)
+        self._pending.clear()
+
+    def _next_seq(self):
+        self._seq = (self._seq + 1) & 0xffff
+        return self._seq
+
+    def _on_readable(self):
+        """
+        Drains every queued reply from the socket and resolves the matching probes.
+        """
+        while True:
+            try:
+                packet, addr = self._sock.recvfrom(2048)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                logger.warning(f"ICMP receive failed: {e}")
+                return
+            received_at = time.perf_counter()
+            if self._raw and self.family == socket.AF_INET:
+                # Raw IPv4 sockets deliver the IP header as well
+                packet = packet[(packet[0] & 0x0f) * 4:]
+            if len(packet) < 8:
+                continue
+            icmp_type, _, _, ident, seq = struct.unpack('!BBHHH', packet[:8])
+            # Datagram sockets rewrite the identifier, the kernel already filters for us
+            if icmp_type != self._reply or (self._raw and ident != self._ident):
+                continue
+            future = self._pending.get((addr[0], seq))
+            if future is not None and not future.done():
+                future.set_result(received_at)
+
+    async def ping(self, ip, timeout=1.0):
+        """
+        Sends one echo request to the given IP address and waits for its reply.
+
+        Args:
+            ip (str): The IP address to ping.
+            timeout (float): Seconds to wait for the reply.
+
+        Returns:
+            float: The round-trip time in seconds, or None if no reply arrived in time.
+        """
+        seq = self._next_seq()
+        payload = struct.pack('!d', time.time()).ljust(16, b'\x00')
+        header = struct.pack('!BBHHH', self._request, 0, 0, self._ident, seq)
+        # The kernel fills in the ICMPv6 checksum, which covers the IPv6 pseudo-header
+        checksum = icmp_checksum(header + payload) if self.family == socket.AF_INET else 0
+        packet = struct.pack('!BBHHH', self._request, 0, checksum, self._ident, seq) + payload
+
+        key = (ip, seq)
+        future = self._loop.create_future()
+        self._pending[key] = future
+        try:
+            sent_at = time.perf_counter()
+            await self._loop.sock_sendto(self._sock, packet, (ip, 0))
+            received_at = await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            return None
+        except OSError as e:
+            logger.debug(f"ICMP send failed: {ip} - Error: {e}")
+            return None
+        finally:
+            self._pending.pop(key, None)
+        return None if received_at is None else received_at - sent_at
+
+
+class RTTEstimator:
+    """
+    Derives probe timeouts from the round-trip times observed per subnet, using the
+    smoothed RTT and RTT variance of TCP's retransmission timer (RFC 6298):
+    timeout = SRTT + 4 * RTTVAR, clamped between a floor and a ceiling.
+
+    Subnets without samples use the ceiling, like RFC 6298's initial RTO, so a
+    fast subnet never shortens the timeout of one that has not answered yet. A
+    host whose probes time out backs off: its timeout doubles with every timeout
+    reported through timed_out(), up to the ceiling. As in Karn's algorithm, the
+    backoff is kept while the host only answers within the backed-off timeout and
+    cleared once it answers within its subnet's.
+    """
+
+    ALPHA = 1 / 8
+    BETA = 1 / 4
+
+    def __init__(self, floor=0.05, ceiling=1.0, prefixlen=24, prefixlen6=64):
+        """
+        Initializes an estimator without samples.
+
+        Args:
+            floor (float): Minimum timeout in seconds.
+            ceiling (float): Maximum timeout in seconds, used for subnets without samples.
+            prefixlen (int): Prefix length of the IPv4 subnets tracked separately.
+            prefixlen6 (int): Prefix length of the IPv6 subnets tracked separately.
+        """
+        self.floor = floor
+        self.ceiling = ceiling
+        self.prefixlen = prefixlen
+        self.prefixlen6 = prefixlen6
+        self._subnets = {}
+        self._backoff = {}
+
+    def _subnet(self, ip):
+        if ':' in ip:
+            return 6, int(ipaddress.IPv6Address(ip)) >> (128 - self.prefixlen6)
+        return int(ipaddress.IPv4Address(ip)) >> (32 - self.prefixlen)
+
+    def _update(self, state, rtt):
+        if state is None:
+            return [rtt, rtt / 2]
+        srtt, rttvar = state
+        rttvar = (1 - self.BETA) * rttvar + self.BETA * abs(srtt - rtt)
+        srtt = (1 - self.ALPHA) * srtt + self.ALPHA * rtt
+        return [srtt, rttvar]
+
+    def observe(self, ip, rtt):
+        """
+        Adds a round-trip time sample.
+
+        Args:
+            ip (str): The IP address that answered.
+            rtt (float): The measured round-trip time in seconds.
+        """
+        subnet = self._subnet(ip)
+        if ip in self._backoff and rtt <= self._base(subnet):
+            del self._backoff[ip]
+        self._subnets[subnet] = self._update(self._subnets.get(subnet), rtt)
+
+    def timed_out(self, ip):
+        """
+        Backs off the timeout of a host whose probe went unanswered.
+
+        Args:
+            ip (str): The IP address that did not answer.
+        """
+        if self.timeout(ip) < self.ceiling:
+            self._backoff[ip] = self._backoff.get(ip, 0) + 1
+
+    def _base(self, subnet):
+        state = self._subnets.get(subnet)
+        if state is None:
+            return self.ceiling
+        srtt, rttvar = state
+        return min(self.ceiling, max(self.floor, srtt + 4 * rttvar))
+
+    def timeout(self, ip):
+        """
+        Returns the timeout to use for the next probe of the given IP address.
+
+        Args:
+            ip (str): The IP address about to be probed.
+
+        Returns:
+            float: The timeout in seconds.
+        """
+        return min(self.ceiling, self._base(self._subnet(ip)) * 2 ** self._backoff.get(ip, 0))
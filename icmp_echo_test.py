@@ -0,0 +1,56 @@
+import pytest
+
+import icmp_echo
+
+
+def test_unsampled_subnets_use_the_ceiling():
+    rtt = icmp_echo.RTTEstimator(floor=0.05, ceiling=1.0)
+    assert rtt.timeout("10.0.0.1") == 1.0
+    rtt.observe("10.0.0.1", 0.02)
+    assert rtt.timeout("10.0.0.2") == pytest.approx(0.06)
+    assert rtt.timeout("10.0.1.1") == 1.0
+    assert rtt.timeout("2001:db8::1") == 1.0
+
+
+def test_timeouts_are_clamped_between_floor_and_ceiling():
+    rtt = icmp_echo.RTTEstimator(floor=0.05, ceiling=1.0)
+    rtt.observe("10.0.0.1", 0.001)
+    rtt.observe("10.0.1.1", 3.0)
+    assert rtt.timeout("10.0.0.1") == 0.05
+    assert rtt.timeout("10.0.1.1") == 1.0
+
+
+def test_timed_out_hosts_back_off_up_to_the_ceiling():
+    rtt = icmp_echo.RTTEstimator(floor=0.05, ceiling=1.0)
+    rtt.observe("10.0.0.1", 0.02)
+    timeouts = []
+    for _ in range(6):
+        rtt.timed_out("10.0.0.9")
+        timeouts.append(rtt.timeout("10.0.0.9"))
+    assert timeouts == pytest.approx([0.12, 0.24, 0.48, 0.96, 1.0, 1.0])
+    # The rest of the subnet keeps its timeout
+    assert rtt.timeout("10.0.0.2") == pytest.approx(0.06)
+
+
+def test_backoff_clears_once_the_host_answers_within_its_subnet_timeout():
+    rtt = icmp_echo.RTTEstimator(floor=0.05, ceiling=10.0)
+    rtt.observe("10.0.0.1", 0.02)
+    rtt.timed_out("10.0.0.9")
+    rtt.timed_out("10.0.0.9")
+    # A late answer only within the backed-off timeout keeps the backoff
+    rtt.observe("10.0.0.9", 0.2)
+    assert rtt.timeout("10.0.0.9") == pytest.approx(4 * rtt.timeout("10.0.0.2"))
+    rtt.observe("10.0.0.9", 0.02)
+    assert rtt.timeout("10.0.0.9") == rtt.timeout("10.0.0.2")
+
+
+def test_icmp_checksum():
+    # Echo request with identifier 1 and sequence number 1, as sent by ping
+    header = bytes([8, 0, 0, 0, 0, 1, 0, 1])
+    assert icmp_echo.icmp_checksum(header + b"abcd") == 0x3337
+    assert icmp_echo.icmp_checksum(b"") == 0xffff
+    # Odd lengths are padded with a zero byte, and a message with its checksum sums to zero
+    packet = header + b"abc"
+    checksum = icmp_echo.icmp_checksum(packet)
+    assert checksum == icmp_echo.icmp_checksum(packet + b"\0")
+    assert icmp_echo.icmp_checksum(packet[:2] + checksum.to_bytes(2, "big") + packet[4:]) == 0